@@ -0,0 +1,67 @@
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveWriter:
+    """Writes finished files to disk on a background thread.
+
+    The queue is bounded: when the disk can't keep up, new files are dropped with a warning
+    instead of making requests wait.
+    """
+
+    def __init__(self, max_queue_size=64):
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, path, data):
+        self._ensure_running()
+        try:
+            self._queue.put_nowait((path, data))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Archive queue full, not saving: %s", path)
+            return False
+        return True
+
+    def flush(self):
+        """Block until everything queued so far is on disk."""
+        self._queue.join()
+
+    def _ensure_running(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='archive-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            path, data = self._queue.get()
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+
+                # write under a temporary name so readers never see a partial file
+                tmp_path = path + '.part'
+                with open(tmp_path, 'wb') as file:
+                    file.write(data)
+                os.replace(tmp_path, path)
+
+                self.written += 1
+                logger.debug("Archived: %s", path)
+            except OSError as e:
+                self.failed += 1
+                logger.error("Could not archive %s: %s", path, e)
+            finally:
+                self._queue.task_done()
+
+
+archive_writer = ArchiveWriter()
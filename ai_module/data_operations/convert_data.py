@@ -1,4 +1,9 @@
+import hashlib
+import io
+import json
+import multiprocessing
 import os
+import time
 
 import mido
 import numpy as np
@@ -80,6 +85,221 @@ def generate_event_fields_vector_float(midi_file, genre):
     return np.array(data)
 
 
+EVENT_TYPES = ['note_on', 'note_off', 'control_change', 'program_change']
+EVENT_FIELDS = ['channel', 'note', 'velocity', 'control', 'value', 'program', 'time']
+FIELD_MAX_VALUES = np.array([max_event_fields_values[field] for field in EVENT_FIELDS], dtype=np.float32)
+
+# bump when encode_midi_file changes, so cached shards of the old encoding are not reused
+ENCODING_VERSION = 1
+
+GENRE_COLUMNS = 3
+EVENT_COLUMNS = len(EVENT_TYPES)
+COLUMNS = GENRE_COLUMNS + EVENT_COLUMNS + len(EVENT_FIELDS)
+
+
+def encode_midi_file(midi_file, genre):
+    """Same rows as generate_event_fields_vector_float, as a float32 (N, 14) array.
+
+    Fields are collected as integers into a preallocated array and clipped and normalized in
+    one go at the end, instead of building a Python list per message.
+    """
+    type_indices = {event_type: i for i, event_type in enumerate(EVENT_TYPES)}
+    n_messages = sum(len(track) for track in midi_file.tracks)
+    raw = np.zeros((n_messages, 1 + len(EVENT_FIELDS)), dtype=np.int64)
+
+    rows = 0
+    for track in midi_file.tracks:
+        for msg in track:
+            type_index = type_indices.get(msg.type)
+            if type_index is None:
+                continue
+
+            row = raw[rows]
+            row[0] = type_index
+            for column, field in enumerate(EVENT_FIELDS, start=1):
+                row[column] = getattr(msg, field, 0)
+            rows += 1
+
+    raw = raw[:rows]
+    data = np.zeros((rows, COLUMNS), dtype=np.float32)
+    data[:, :GENRE_COLUMNS] = generate_genre_vector(genre)
+    data[np.arange(rows), GENRE_COLUMNS + raw[:, 0]] = 1.0
+    np.clip(raw[:, 1:], 0, FIELD_MAX_VALUES.astype(np.int64), out=raw[:, 1:])
+    np.divide(raw[:, 1:], FIELD_MAX_VALUES, out=data[:, GENRE_COLUMNS + EVENT_COLUMNS:], casting='unsafe')
+    return data
+
+
+def shard_key(midi_bytes, genre):
+    """Cache key of an encoded file: its content, genre label and the encoding version."""
+    sha256 = hashlib.sha256(f"{ENCODING_VERSION}:{genre.strip().lower()}:".encode())
+    sha256.update(midi_bytes)
+    return sha256.hexdigest()
+
+
+def _encode_file(job):
+    """Returns (filename, genre, data, shard path, cache hit, error).
+
+    Without a cache_dir the encoded rows come back as data. With one they are written to a
+    shard there, unless it already exists, and only its path comes back.
+    """
+    filename, genre, filepath, cache_dir = job
+    if not os.path.exists(filepath):
+        return filename, genre, None, None, False, "missing file"
+    try:
+        with open(filepath, 'rb') as midi_file:
+            midi_bytes = midi_file.read()
+
+        shard_path = None
+        if cache_dir:
+            key = shard_key(midi_bytes, genre)
+            shard_path = os.path.join(cache_dir, key[:2], key + '.npy')
+            if os.path.exists(shard_path):
+                return filename, genre, None, shard_path, True, None
+
+        data = encode_midi_file(mido.MidiFile(file=io.BytesIO(midi_bytes)), genre)
+        if shard_path is None:
+            return filename, genre, data, None, False, None
+
+        os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+        tmp_path = shard_path + f'.{os.getpid()}.part'
+        with open(tmp_path, 'wb') as shard_file:
+            np.save(shard_file, data)
+        os.replace(tmp_path, shard_path)
+        return filename, genre, None, shard_path, False, None
+    except Exception as e:
+        return filename, genre, None, None, False, str(e)
+
+
+def build_event_dataset(labels_df, midi_files_dir, output_dir, workers=None, chunksize=4, cache_dir=None):
+    """Encode every labelled MIDI file into one float32 event array on disk.
+
+    Files are parsed in a process pool and their rows streamed, in label order, to
+    output_dir/events.f32; nothing bigger than one file's events is held in memory.
+    output_dir/dataset.json records the shape and the rows of every file. Open the result with
+    load_event_dataset() and cut it into training windows with event_windows().
+
+    With cache_dir every file is encoded once into a shard keyed on shard_key(), and rebuilds
+    only parse new or changed files (or files whose genre label changed); the dataset is
+    assembled from the shards. The cache hits and misses and the build time are reported in
+    dataset.json under 'build'.
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    events_path = os.path.join(output_dir, 'events.f32')
+    jobs = [
+        (row['filename'], row['genre'], os.path.join(midi_files_dir, row['filename']), cache_dir)
+        for _, row in labels_df.iterrows()
+    ]
+
+    files = []
+    skipped = []
+    total_rows = 0
+    hits = misses = 0
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool, open(events_path + '.part', 'wb') as events_file:
+        for filename, genre, data, shard_path, hit, error in pool.imap(_encode_file, jobs, chunksize=chunksize):
+            if error is not None:
+                print(f"skipping '{filename}': {error}")
+                skipped.append({'filename': filename, 'error': error})
+                continue
+
+            if shard_path is not None:
+                hits += hit
+                misses += not hit
+                data = np.load(shard_path, mmap_mode='r')
+
+            events_file.write(data.tobytes())
+            files.append({'filename': filename, 'genre': genre, 'start': total_rows, 'rows': len(data)})
+            total_rows += len(data)
+
+    os.replace(events_path + '.part', events_path)
+
+    build = {
+        'seconds': time.perf_counter() - start,
+        'cache_dir': cache_dir,
+        'cache_hits': hits,
+        'cache_misses': misses,
+        'encoding_version': ENCODING_VERSION,
+    }
+    meta = {
+        'rows': total_rows,
+        'columns': COLUMNS,
+        'dtype': 'float32',
+        'files': files,
+        'skipped': skipped,
+        'build': build,
+    }
+    with open(os.path.join(output_dir, 'dataset.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    print(f"saved {total_rows} events from {len(files)} files to {output_dir} ({len(skipped)} skipped) "
+          f"in {build['seconds']:.1f}s")
+    if cache_dir:
+        print(f"cache: {hits} hits, {misses} misses")
+    return meta
+
+
+def load_event_dataset(dataset_dir):
+    """Returns (events, meta) with events a read-only memory map of the (rows, 14) array."""
+    with open(os.path.join(dataset_dir, 'dataset.json')) as meta_file:
+        meta = json.load(meta_file)
+
+    events = np.memmap(
+        os.path.join(dataset_dir, 'events.f32'),
+        dtype=meta['dtype'],
+        mode='r',
+        shape=(meta['rows'], meta['columns'])
+    )
+    return events, meta
+
+
+def event_windows(events, sequence_length):
+    """The X, y1, y2 of prepare_sequences_multi_output as views of events, without copying.
+
+    X[i] is events[i:i + sequence_length], y1/y2 are the event type and fields of the event
+    right after it.
+    """
+    if len(events) < sequence_length:
+        # sliding_window_view needs at least one full window
+        X = np.zeros((0, sequence_length, events.shape[1]), dtype=events.dtype)
+    else:
+        windows = np.lib.stride_tricks.sliding_window_view(events, sequence_length, axis=0)
+        X = windows[:len(events) - sequence_length].transpose(0, 2, 1)
+    y1 = events[sequence_length:, GENRE_COLUMNS:GENRE_COLUMNS + EVENT_COLUMNS]
+    y2 = events[sequence_length:, GENRE_COLUMNS + EVENT_COLUMNS:]
+    return X, y1, y2
+
+
+def window_batches(events, sequence_length, batch_size=256, shuffle=True, seed=None):
+    """Yield (X, (y1, y2)) training batches; only one batch of windows is copied at a time."""
+    X, y1, y2 = event_windows(events, sequence_length)
+    order = np.arange(len(X))
+    if shuffle:
+        np.random.default_rng(seed).shuffle(order)
+
+    for start in range(0, len(order), batch_size):
+        indices = np.sort(order[start:start + batch_size])
+        yield X[indices], (y1[indices], y2[indices])
+
+
+def window_dataset(events, sequence_length, batch_size=256, shuffle=True, seed=None):
+    """window_batches() as a tf.data.Dataset for model.fit()."""
+    import tensorflow as tf
+
+    columns = events.shape[1]
+    return tf.data.Dataset.from_generator(
+        lambda: window_batches(events, sequence_length, batch_size, shuffle, seed),
+        output_signature=(
+            tf.TensorSpec((None, sequence_length, columns), tf.float32),
+            (
+                tf.TensorSpec((None, EVENT_COLUMNS), tf.float32),
+                tf.TensorSpec((None, len(EVENT_FIELDS)), tf.float32),
+            ),
+        )
+    ).prefetch(tf.data.AUTOTUNE)
+
+
 def prepare_sequences_multi_output(data, sequence_length):
     X = []
 
@@ -109,15 +329,14 @@ def generate_event_fields_vectors_float(labels_df, midi_files_dir, sequence_leng
         if os.path.exists(filepath):
             try:
                 midi = mido.MidiFile(filepath)
-                track_data = generate_event_fields_vector_float(midi, genre)
-                data.extend(track_data)
+                data.append(encode_midi_file(midi, genre))
             except Exception as e:
                 print(f"skipping '{filename}': {e}")
         else:
             print(f"missing file: {filename}")
 
-    data = np.array(data)
-    X, y1, y2 = prepare_sequences_multi_output(data, sequence_length)
+    data = np.concatenate(data) if data else np.zeros((0, COLUMNS), dtype=np.float32)
+    X, y1, y2 = (np.array(part) for part in event_windows(data, sequence_length))
 
     if save_path:
         np.savez_compressed(save_path, X=X, y1=y1, y2=y2)
@@ -0,0 +1,191 @@
+"""Compact event sequences backed by a structured numpy array, written to MIDI without mido.
+
+A generated piece is EVENT_DTYPE records, 9 bytes per event, instead of a list of validated
+mido.Message objects. to_midi_bytes() encodes the Standard MIDI File bytes straight from the
+array, byte for byte what mido writes for the same messages (running status included), which
+benchmarks/midi_encoding_parity.py checks.
+to_messages(), from_messages() and to_midi() convert from and to mido where it is still needed.
+"""
+import io
+
+import mido
+import numpy as np
+
+EVENT_TYPES = ['note_on', 'note_off', 'control_change', 'program_change']
+
+MAX_VALUES = {
+    'channel': 15,
+    'note': 127,
+    'velocity': 127,
+    'program': 127,
+    'control': 127,
+    'value': 127,
+    'time': 65530
+}
+
+# order of the param fields in an event vector, after the event type one-hot
+EVENT_FIELDS = ['channel', 'note', 'velocity', 'control', 'value', 'program', 'time']
+FIELD_MAX_VALUES = np.array([MAX_VALUES[field] for field in EVENT_FIELDS], dtype=np.float32)
+
+TICKS_PER_BEAT = 1000
+
+EVENT_DTYPE = np.dtype([
+    ('type', np.uint8),  # index into EVENT_TYPES
+    ('channel', np.uint8),
+    ('note', np.uint8),  # control number of control_change
+    ('velocity', np.uint8),  # control value of control_change
+    ('program', np.uint8),
+    ('time', np.uint32),  # delta time in ticks
+])
+
+NOTE_ON, NOTE_OFF, CONTROL_CHANGE, PROGRAM_CHANGE = range(len(EVENT_TYPES))
+
+# MIDI status byte of every event type on channel 0
+STATUS_BYTES = np.array([0x90, 0x80, 0xB0, 0xC0], dtype=np.uint8)
+
+END_OF_TRACK = b'\x00\xff\x2f\x00'
+
+
+class EventSequence:
+    """A piece as an EVENT_DTYPE array; fields that don't apply to an event's type are 0."""
+
+    def __init__(self, events=None):
+        self.events = np.zeros(0, dtype=EVENT_DTYPE) if events is None else np.asarray(events, dtype=EVENT_DTYPE)
+
+    def __len__(self):
+        return len(self.events)
+
+    @classmethod
+    def from_vectors(cls, event_vectors):
+        """Decode an (N, 11) array of event vectors, with the same rounding as decode_event_vectors()."""
+        event_vectors = np.asarray(event_vectors, dtype=np.float32)
+        n_types = len(EVENT_TYPES)
+
+        types = np.argmax(event_vectors[:, :n_types], axis=1)
+        fields = (event_vectors[:, n_types:] * FIELD_MAX_VALUES).astype(np.int64)
+        np.clip(fields, 0, FIELD_MAX_VALUES.astype(np.int64), out=fields)
+        channel, note, velocity, control, value, program, time = fields.T
+
+        is_note = types <= NOTE_OFF
+        is_control = types == CONTROL_CHANGE
+
+        events = np.empty(len(types), dtype=EVENT_DTYPE)
+        events['type'] = types
+        events['channel'] = channel
+        events['note'] = np.where(is_note, note, np.where(is_control, control, 0))
+        events['velocity'] = np.where(is_note, velocity, np.where(is_control, value, 0))
+        events['program'] = np.where(types == PROGRAM_CHANGE, program, 0)
+        events['time'] = time
+        return cls(events)
+
+    @classmethod
+    def from_messages(cls, messages):
+        """Keep the note, control_change and program_change messages; the delta time of any other
+        message is added to the next one kept."""
+        records = []
+        pending_time = 0
+        for message in messages:
+            pending_time += message.time
+            if message.type not in EVENT_TYPES:
+                continue
+
+            type_index = EVENT_TYPES.index(message.type)
+            if type_index <= NOTE_OFF:
+                records.append((type_index, message.channel, message.note, message.velocity, 0, pending_time))
+            elif type_index == CONTROL_CHANGE:
+                records.append((type_index, message.channel, message.control, message.value, 0, pending_time))
+            else:
+                records.append((type_index, message.channel, 0, 0, message.program, pending_time))
+            pending_time = 0
+
+        return cls(np.array(records, dtype=EVENT_DTYPE))
+
+    @classmethod
+    def from_midi(cls, midi):
+        return cls.from_messages(mido.merge_tracks(midi.tracks))
+
+    @classmethod
+    def program_changes(cls, program, channels):
+        events = np.zeros(len(channels), dtype=EVENT_DTYPE)
+        events['type'] = PROGRAM_CHANGE
+        events['channel'] = channels
+        events['program'] = program
+        return cls(events)
+
+    def note_channels(self):
+        """Channels with note events, sorted."""
+        return np.unique(self.events['channel'][self.events['type'] <= NOTE_OFF])
+
+    def with_instrument(self, instrument):
+        """The sequence preceded by a program change to instrument on every channel it plays notes on."""
+        prefix = self.program_changes(instrument, self.note_channels())
+        return EventSequence(np.concatenate([prefix.events, self.events]))
+
+    def to_messages(self):
+        events = self.events
+        messages = []
+        for type_index, channel, note, velocity, program, time in zip(
+                events['type'].tolist(), events['channel'].tolist(), events['note'].tolist(),
+                events['velocity'].tolist(), events['program'].tolist(), events['time'].tolist()
+        ):
+            event_type = EVENT_TYPES[type_index]
+            if type_index <= NOTE_OFF:
+                messages.append(mido.Message(event_type, channel=channel, note=note, velocity=velocity, time=time))
+            elif type_index == CONTROL_CHANGE:
+                messages.append(mido.Message(event_type, channel=channel, control=note, value=velocity, time=time))
+            else:
+                messages.append(mido.Message(event_type, channel=channel, program=program, time=time))
+        return messages
+
+    def to_midi(self, instrument=None, ticks_per_beat=TICKS_PER_BEAT):
+        """A one-track mido.MidiFile; with an instrument it starts with with_instrument() program changes."""
+        sequence = self.with_instrument(instrument) if instrument is not None else self
+        midi = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+        midi.tracks.append(mido.MidiTrack(sequence.to_messages()))
+        return midi
+
+    def track_bytes(self):
+        """Data of the MTrk chunk: delta times, events with running status, end of track."""
+        events = self.events
+        n = len(events)
+        types = events['type']
+        time = events['time'].astype(np.int64)
+
+        # up to 4 bytes of variable length delta time, then status and two data bytes
+        rows = np.zeros((n, 7), dtype=np.uint8)
+        mask = np.zeros((n, 7), dtype=bool)
+
+        vlq_length = 1 + (time >= 1 << 7) + (time >= 1 << 14) + (time >= 1 << 21)
+        for i in range(4):
+            shift = 7 * (3 - i)
+            continuation = 0x80 if i < 3 else 0
+            rows[:, i] = ((time >> shift) & 0x7F) | continuation
+            mask[:, i] = i >= 4 - vlq_length
+
+        status = STATUS_BYTES[types] | events['channel']
+        rows[:, 4] = status
+        mask[:1, 4] = True
+        mask[1:, 4] = status[1:] != status[:-1]
+
+        rows[:, 5] = np.where(types == PROGRAM_CHANGE, events['program'], events['note'])
+        mask[:, 5] = True
+        rows[:, 6] = events['velocity']
+        mask[:, 6] = types != PROGRAM_CHANGE
+
+        return rows[mask].tobytes() + END_OF_TRACK
+
+    def to_midi_bytes(self, instrument=None, ticks_per_beat=TICKS_PER_BEAT):
+        """Standard MIDI File bytes of to_midi(instrument, ticks_per_beat), without building messages."""
+        sequence = self.with_instrument(instrument) if instrument is not None else self
+        track = sequence.track_bytes()
+
+        buffer = io.BytesIO()
+        buffer.write(b'MThd' + (6).to_bytes(4, 'big'))
+        buffer.write((1).to_bytes(2, 'big') + (1).to_bytes(2, 'big') + ticks_per_beat.to_bytes(2, 'big'))
+        buffer.write(b'MTrk' + len(track).to_bytes(4, 'big'))
+        buffer.write(track)
+        return buffer.getvalue()
+
+    def save(self, path, instrument=None, ticks_per_beat=TICKS_PER_BEAT):
+        with open(path, 'wb') as file:
+            file.write(self.to_midi_bytes(instrument, ticks_per_beat))
@@ -1,26 +1,27 @@
 import datetime
+import io
+import logging
 import os
 import random
+import time
 
 import mido
 import numpy as np
-from tensorflow.keras.models import load_model
 
+from ai_module.archive_writer import archive_writer
+from ai_module.event_sequence import EVENT_TYPES, MAX_VALUES, TICKS_PER_BEAT, EventSequence
+from ai_module.inference import as_engine
+from ai_module.model_registry import get_engine
+from ai_module.rejection_stats import rejection_stats
+from ai_module.sampling import SamplingStream, make_rng, sample_with_temperature
 from ai_module.resources.filename_generator import generate_filename
+from ai_module.tracing import add_stage, annotate, stage
 from diversity import Diversity
 
+logger = logging.getLogger(__name__)
+
 # --- Constants ---
-EVENT_TYPES = ['note_on', 'note_off', 'control_change', 'program_change']
-
-MAX_VALUES = {
-    'channel': 15,
-    'note': 127,
-    'velocity': 127,
-    'program': 127,
-    'control': 127,
-    'value': 127,
-    'time': 65530
-}
+NOTE_EVENT_INDICES = [EVENT_TYPES.index('note_on'), EVENT_TYPES.index('note_off')]
 
 POP_GENERATION_VALUES = {
     0.4: [0.03, 0.07],
@@ -80,6 +81,20 @@ def decode_event_vector(event_vector):
     return None
 
 
+def decode_event_vectors(event_vectors):
+    """Decode an (N, 11) array of event vectors into mido messages in one pass."""
+    return EventSequence.from_vectors(event_vectors).to_messages()
+
+
+def event_note_ratios(events):
+    """Share of note_on/note_off events in each row of a (B, N, 11) event array."""
+    events = np.asarray(events)
+    if events.shape[-2] == 0:
+        return np.zeros(events.shape[:-2])
+    type_indices = np.argmax(events[..., :len(EVENT_TYPES)], axis=-1)
+    return np.isin(type_indices, NOTE_EVENT_INDICES).mean(axis=-1)
+
+
 # --- Prediction ---
 def pad_sequence_to_length(seq, target_len):
     if len(seq) >= target_len:
@@ -89,69 +104,230 @@ def pad_sequence_to_length(seq, target_len):
     return np.vstack([padding, seq])
 
 
-def generate_sequence(
+class GenerationBatch:
+    """Autoregressive state of B sequences advanced together, one forward pass per step.
+
+    temperatures and param_noise_stds can be scalars or one value per seed. progress, if given,
+    is called with (steps_done, total_steps) after every step. The uniforms for sampling and the
+    noise of the whole sequence are drawn from rng, a numpy Generator, before the first step;
+    without one the batch gets its own.
+
+    The note ratio of every row is tracked as it is generated. With min_note_ratio a row is
+    rejected as soon as it can't reach that ratio even if all its remaining events were notes;
+    with running_note_ratio also when its ratio so far drops below it after warm_up_steps. Once
+    every row is rejected the batch stops early and `aborted` is set.
+
+    The sliding windows live in a preallocated buffer twice the window length. Every event is
+    written at its ring position and again fixed_length further on, so the current window is
+    always a contiguous slice and `sequences` is a view, never a copy.
+    """
+
+    def __init__(
+            self,
+            seed_sequences,
+            genre_vector,
+            length=500,
+            fixed_length=50,
+            temperatures=0.01,
+            param_noise_stds=0.001,
+            progress=None,
+            rng=None,
+            min_note_ratio=None,
+            running_note_ratio=None,
+            warm_up_steps=100
+    ):
+        self.batch_size = len(seed_sequences)
+        self.steps_left = int(np.ceil(length))
+        self.total_steps = self.steps_left
+        self.progress = progress
+        self.fixed_length = fixed_length
+
+        windows = np.stack([pad_sequence_to_length(seed, fixed_length) for seed in seed_sequences])
+        self._buffer = np.empty((self.batch_size, 2 * fixed_length, windows.shape[2]), dtype=np.float32)
+        self._buffer[:, :fixed_length] = windows
+        self._buffer[:, fixed_length:] = windows
+        self._position = fixed_length - 1
+
+        self.genres = np.broadcast_to(np.asarray(genre_vector, dtype=np.float32), (self.batch_size, len(genre_vector)))
+        self.temperatures = np.broadcast_to(np.asarray(temperatures, dtype=np.float64), (self.batch_size,))
+        self.draws = SamplingStream(
+            rng if rng is not None else make_rng(),
+            self.batch_size,
+            self.total_steps,
+            windows.shape[2] - len(EVENT_TYPES),
+            np.broadcast_to(np.asarray(param_noise_stds, dtype=np.float32), (self.batch_size,))
+        )
+        self.rows = np.arange(self.batch_size)
+
+        # raw event vectors of every step, decoded to messages only at the end
+        self.events = np.empty((self.batch_size, self.steps_left, windows.shape[2]), dtype=np.float32)
+        self.steps_done = 0
+
+        self.min_note_ratio = min_note_ratio
+        self.running_note_ratio = running_note_ratio
+        self.warm_up_steps = warm_up_steps
+        self.note_counts = np.zeros(self.batch_size, dtype=np.int64)
+        self.rejected = np.zeros(self.batch_size, dtype=bool)
+        self.aborted = False
+
+        # perf_counter() when a GenerationScheduler took the batch into its shared batch
+        self.admitted_at = None
+
+    @property
+    def sequences(self):
+        start = self._position + 1
+        return self._buffer[:, start:start + self.fixed_length]
+
+    @property
+    def done(self):
+        return self.steps_left <= 0
+
+    @property
+    def generated(self):
+        return [decode_event_vectors(row_events) for row_events in self.events[:, :self.steps_done]]
+
+    def advance(self, y_type_logits, y_params):
+        n_types = y_type_logits.shape[1]
+        event_vectors = self.events[:, self.steps_done]
+
+        # sample event type using temperature, one-hot it
+        type_indices = sample_with_temperature(y_type_logits, self.temperatures, self.draws.uniforms[self.steps_done])
+        event_vectors[:, :n_types] = 0.0
+        event_vectors[self.rows, type_indices] = 1.0
+        self.note_counts += (type_indices == NOTE_EVENT_INDICES[0]) | (type_indices == NOTE_EVENT_INDICES[1])
+
+        # add noise to params to avoid exact loops
+        params = event_vectors[:, n_types:]
+        np.add(self.draws.noise[self.steps_done], y_params, out=params)
+        np.clip(params, 0, 1, out=params)
+
+        # slide the windows
+        self._position = (self._position + 1) % self.fixed_length
+        self._buffer[:, self._position] = event_vectors
+        self._buffer[:, self._position + self.fixed_length] = event_vectors
+        self.steps_done += 1
+        self.steps_left -= 1
+        self._check_note_ratios()
+
+        if self.progress is not None:
+            self.progress(self.steps_done, self.total_steps)
+
+
+    def _check_note_ratios(self):
+        if self.min_note_ratio is not None:
+            best_possible = (self.note_counts + self.steps_left) / self.total_steps
+            self.rejected |= best_possible < self.min_note_ratio
+
+        if self.running_note_ratio is not None and self.steps_done >= self.warm_up_steps:
+            self.rejected |= self.note_counts / self.steps_done < self.running_note_ratio
+
+        if self.steps_left > 0 and self.rejected.all():
+            self.steps_left = 0
+            self.aborted = True
+
+
+def run_batch(engine, batch, incremental=False):
+    """Step a GenerationBatch through the engine until it is done."""
+    if incremental:
+        with engine.stateful_decoder(batch.batch_size) as decoder:
+            outputs = decoder.prime(batch.sequences, batch.genres)
+            while not batch.done:
+                batch.advance(*outputs)
+                if not batch.done:
+                    outputs = decoder.step(batch.sequences[:, -1:], batch.genres)
+    else:
+        while not batch.done:
+            batch.advance(*engine.predict(batch.sequences, batch.genres))
+
+
+def generate_sequences_batch(
         model,
-        seed_sequence,
+        seed_sequences,
         genre_vector,
         length=500,
         fixed_length=50,
-        temperature=0.01,
-        param_noise_std=0.001
+        temperatures=0.01,
+        param_noise_stds=0.001,
+        incremental=False,
+        decode=True,
+        progress=None,
+        rng=None
 ):
-    def sample_with_temperature(logits, temp):
-        logits = np.log(np.clip(logits, 1e-8, 1.0)) / temp
-        probs = np.exp(logits) / np.sum(np.exp(logits))
-        return np.random.choice(len(probs), p=probs)
+    """Advance all seed sequences in lockstep and return one list of messages per seed.
 
-    generated = []
-    sequence = pad_sequence_to_length(seed_sequence, fixed_length)
+    With decode=False the raw (B, length, 11) event array is returned instead.
 
-    while len(generated) < length:
-        input_seq = np.expand_dims(sequence, axis=0)
-        input_genre = np.expand_dims(genre_vector, axis=0)
+    With incremental=True the model runs as a stateful decoder: the seed window is fed once
+    and each step costs one recurrent timestep instead of re-running the whole window. The
+    decoder remembers the full history rather than the last fixed_length events, so outputs
+    match the windowed path exactly only for the first step.
+    """
+    batch = GenerationBatch(
+        seed_sequences, genre_vector, length, fixed_length, temperatures, param_noise_stds, progress, rng
+    )
+    run_batch(as_engine(model), batch, incremental)
 
-        y_type_logits, y_params = model.predict(
-            {"sequence_input": input_seq, "genre_input": input_genre}, verbose=0
-        )
+    return batch.generated if decode else batch.events
 
-        # sample event type using temperature
-        event_type_idx = sample_with_temperature(y_type_logits[0], temperature)
 
-        # create one-hot event type
-        event_type = np.zeros_like(y_type_logits[0])
-        event_type[event_type_idx] = 1.0
+def generate_sequence(
+        model,
+        seed_sequence,
+        genre_vector,
+        length=500,
+        fixed_length=50,
+        temperature=0.01,
+        param_noise_std=0.001,
+        incremental=False,
+        rng=None
+):
+    return generate_sequences_batch(
+        model,
+        [seed_sequence],
+        genre_vector,
+        length=length,
+        fixed_length=fixed_length,
+        temperatures=temperature,
+        param_noise_stds=param_noise_std,
+        incremental=incremental,
+        rng=rng
+    )[0]
 
-        # add noise to params to avoid exact loops
-        y_params_noisy = y_params[0] + np.random.normal(0, param_noise_std, size=y_params[0].shape)
-        y_params_noisy = np.clip(y_params_noisy, 0, 1)
 
-        # combine and decode
-        event_vector = np.concatenate([event_type, y_params_noisy])
-        msg = decode_event_vector(event_vector)
-        if msg:
-            generated.append(msg)
+# --- Save to MIDI ---
+def instrument_messages(instrument=0, channels=range(MAX_VALUES['channel'] + 1)):
+    return [
+        mido.Message('program_change', program=instrument, channel=channel, time=0)
+        for channel in channels
+    ]
 
-        # update sequence
-        next_vec = np.concatenate([event_type, y_params_noisy])
-        sequence = np.vstack([sequence[1:], next_vec])
 
-    return generated
+def note_channels(messages):
+    return sorted({message.channel for message in messages if message.type in ('note_on', 'note_off')})
 
 
-# --- Save to MIDI ---
-def save_midi(messages, output_path="generated_output_v2.mid", instrument=0):
-    midi = mido.MidiFile(ticks_per_beat=1000)
+def build_midi(messages, instrument=0):
+    """One-track MidiFile of messages, with a program change to instrument on every channel that plays notes."""
+    midi = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
     track = mido.MidiTrack()
     midi.tracks.append(track)
 
-    for i in range(0, MAX_VALUES['channel']):
-        track.append(mido.Message('program_change', program=instrument, channel=i, time=0))
+    track.extend(instrument_messages(instrument, note_channels(messages)))
+    track.extend(messages)
+
+    return midi
+
 
-    for msg in messages:
-        track.append(msg)
+def serialize_midi(midi):
+    midi_buffer = io.BytesIO()
+    midi.save(file=midi_buffer)
+    return midi_buffer.getvalue()
 
+
+def save_midi(messages, output_path="generated_output_v2.mid", instrument=0):
+    midi = build_midi(messages, instrument)
     midi.save(output_path)
-    print(f"[INFO] Saved MIDI to: {output_path}")
+    logger.info("Saved MIDI to: %s", output_path)
 
     return midi
 
@@ -166,49 +342,52 @@ def generate_genre_vector(genre):
     return np.array(genre_dict.get(genre.strip().lower(), [0, 0, 0]), dtype=np.float32)
 
 
-def random_genre_vector():
+def random_genre_vector(rng=None):
+    rng = rng if rng is not None else make_rng()
     genres = ['pop', 'rock', 'country']
-    chosen = np.random.choice(genres)
+    chosen = str(rng.choice(genres))
     return generate_genre_vector(chosen), chosen
 
 
-def create_random_event_vector():
-    event_type_idx = np.random.randint(0, len(EVENT_TYPES))
+def create_random_event_vector(rng=None):
+    rng = rng if rng is not None else make_rng()
+    event_type_idx = int(rng.integers(0, len(EVENT_TYPES)))
     event_one_hot = np.zeros(len(EVENT_TYPES), dtype=np.float32)
     event_one_hot[event_type_idx] = 1.0
 
     params = np.zeros(7, dtype=np.float32)
 
     if EVENT_TYPES[event_type_idx] in ['note_on', 'note_off']:
-        params[0] = np.random.rand()
-        params[1] = np.random.rand()
-        params[2] = np.random.rand()
-        params[6] = np.random.rand()
+        params[0] = rng.random()
+        params[1] = rng.random()
+        params[2] = rng.random()
+        params[6] = rng.random()
     elif EVENT_TYPES[event_type_idx] == 'control_change':
-        params[0] = np.random.rand()
-        params[3] = np.random.rand()
-        params[4] = np.random.rand()
-        params[6] = np.random.rand()
+        params[0] = rng.random()
+        params[3] = rng.random()
+        params[4] = rng.random()
+        params[6] = rng.random()
     elif EVENT_TYPES[event_type_idx] == 'program_change':
-        params[0] = np.random.rand()
-        params[5] = np.random.rand()
-        params[6] = np.random.rand()
+        params[0] = rng.random()
+        params[5] = rng.random()
+        params[6] = rng.random()
 
     return np.concatenate([event_one_hot, params])
 
 
-def generate_random_seed_sequence(length=5, input_dim=11, fixed_length=50):
-    seed = np.array([create_random_event_vector() for _ in range(length)], dtype=np.float32)
+def generate_random_seed_sequence(length=5, input_dim=11, fixed_length=50, rng=None):
+    rng = rng if rng is not None else make_rng()
+    seed = np.array([create_random_event_vector(rng) for _ in range(length)], dtype=np.float32)
     return pad_sequence_to_length(seed, fixed_length)
 
 
 def run_batch_tests():
     model_path = "model/final_model_3.keras"
     if not os.path.exists(model_path):
-        print("[ERROR] Model file not found.")
+        logger.error("Model file not found.")
         return
 
-    model = load_model(model_path)
+    model = get_engine(model_path)
     fixed_length = 50
     input_dim = 11
     sequence_length = 200
@@ -218,6 +397,7 @@ def run_batch_tests():
     param_noise_values = [0.0, 0.01, 0.03, 0.05, 0.07]
 
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    rng = make_rng()
 
     for genre in genres:
         genre_vector = generate_genre_vector(genre)
@@ -228,15 +408,16 @@ def run_batch_tests():
                 os.makedirs(subdir, exist_ok=True)
 
                 seed_sequence = generate_random_seed_sequence(
-                    length=np.random.randint(1, 10),
+                    length=int(rng.integers(1, 10)),
                     input_dim=input_dim,
-                    fixed_length=fixed_length
+                    fixed_length=fixed_length,
+                    rng=rng
                 )
 
                 filename = f"{timestamp}_{genre}_T{temp}_N{noise}.mid"
                 output_path = os.path.join(subdir, filename)
 
-                print(f"[GEN] {genre} | T={temp} | noise={noise} -> {filename}")
+                logger.info("%s | T=%s | noise=%s -> %s", genre, temp, noise, filename)
 
                 midi_msgs = generate_sequence(
                     model,
@@ -245,7 +426,8 @@ def run_batch_tests():
                     length=sequence_length,
                     fixed_length=fixed_length,
                     temperature=temp,
-                    param_noise_std=noise
+                    param_noise_std=noise,
+                    rng=rng
                 )
 
                 save_midi(midi_msgs, output_path)
@@ -260,14 +442,31 @@ def is_note_message(msg):
     return msg.type == 'note_on' or msg.type == 'note_off'
 
 
+def note_ratio(midi_msgs):
+    if not midi_msgs:
+        return 0.0
+    return sum(1 for msg in midi_msgs if is_note_message(msg)) / len(midi_msgs)
+
+
 def is_sufficiently_note_based(midi_msgs, threshold=0.8):
     if not midi_msgs:
         return False
-    note_count = sum(1 for msg in midi_msgs if is_note_message(msg))
-    return (note_count / len(midi_msgs)) >= threshold
+    return note_ratio(midi_msgs) >= threshold
+
+
+def select_candidate(events, threshold=0.5, rejected=None):
+    """Return (index, note ratio) of the first candidate in a (B, N, 11) event array passing
+    the threshold and not marked in rejected, or of the best one."""
+    ratios = event_note_ratios(events)
+    passing = ratios >= threshold
+    if rejected is not None:
+        passing &= ~rejected
+    passing = np.flatnonzero(passing)
+    index = int(passing[0]) if len(passing) else int(np.argmax(ratios))
+    return index, float(ratios[index])
 
 
-def find_temperature(temperatures, diversity):
+def find_temperature(temperatures, diversity, rng=random):
     one_third_length = len(temperatures) // 3
     two_third_length = 2 * len(temperatures) // 3
 
@@ -276,92 +475,331 @@ def find_temperature(temperatures, diversity):
     upper_third = temperatures[two_third_length:]
 
     if diversity == Diversity.LOW:
-        return random.choice(lower_third)
+        return rng.choice(lower_third)
     elif diversity == Diversity.MEDIUM:
-        return random.choice(middle_third)
+        return rng.choice(middle_third)
     else:
-        return random.choice(upper_third)
+        return rng.choice(upper_third)
+
+
+GENERATION_VALUES = {
+    'pop': POP_GENERATION_VALUES,
+    'rock': ROCK_GENERATION_VALUES,
+    'country': COUNTRY_GENERATION_VALUES,
+}
+
+
+def genre_label(genre):
+    """The genre a piece is generated as; genres without their own generation values count as 'undefined'.
+
+    Also the genre label of the metrics, so request input can't add series.
+    """
+    genre = str(genre).lower()
+    return genre if genre in GENERATION_VALUES else 'undefined'
+
+
+def choose_generation_values(genre_name, diversity, rng=random):
+    values = GENERATION_VALUES.get(genre_name)
+    if values is None:
+        return 2.0, 0.01
+
+    temperature = find_temperature(list(values.keys()), diversity, rng)
+    noise = rng.choice(values[temperature])
+    return temperature, noise
+
+
+def resolve_genre(genre, rng=None):
+    if genre is None:
+        genre_vector, genre_name = random_genre_vector(rng)
+        logger.debug("Losowy gatunek: %s", genre_name)
+    else:
+        genre_vector = generate_genre_vector(genre)
+        genre_name = genre
+        logger.debug("Użytkownik podał gatunek: %s", genre_name)
+
+    logger.debug("Wektor gatunku: %s", genre_vector)
+    return genre_vector, genre_name
 
 
 # --- Main function ---
-def generate(
-        model_path="ai_module/model/final_model_3.keras",
-        output_path="ai_module/results/",
+DEFAULT_MODEL_PATH = "ai_module/model/final_model_3.keras"
+
+
+def generate_piece(
+        model_path=DEFAULT_MODEL_PATH,
         sequence_length=1000,
         genre='undefined',
-        instrument=113,
-        diversity=Diversity.MEDIUM
+        diversity=Diversity.MEDIUM,
+        compiled_inference=True,
+        candidates=4,
+        scheduler=None,
+        incremental=False,
+        progress=None,
+        seed=None,
+        min_note_ratio=0.5,
+        running_note_ratio=0.25,
+        warm_up_steps=100,
+        max_attempts=8
 ):
-    if not os.path.exists(model_path):
-        print("[ERROR] Model file not found.")
-        return
+    """Generate the events of a piece that passes the note-ratio filter.
 
-    model = load_model(model_path)
+    Returns (events, genre_vector), events being the (sequence_length, 11) array of the accepted
+    candidate. See generate() for the arguments.
+    """
+    with stage('load_model'):
+        model = get_engine(model_path, compiled=compiled_inference)
 
     fixed_length = 50
     input_dim = 11
 
-    if genre is None:
-        genre_vector, genre_name = random_genre_vector()
-        print(f"[INFO] Losowy gatunek: {genre_name}")
-    else:
-        genre_vector = generate_genre_vector(genre)
-        genre_name = genre
-        print(f"[INFO] Użytkownik podał gatunek: {genre_name}")
-
-    print(genre_vector)
+    # per-request RNGs, seeded from the OS when there is no seed
+    np_rng, py_rng = make_rng(seed), random.Random(seed)
+    if seed is not None:
+        scheduler = None
 
-    print("[INFO] Generowanie sekwencji...")
+    genre_vector, genre_name = resolve_genre(genre, np_rng)
 
-    filename = generate_filename(genre_vector)
+    logger.debug("Generowanie sekwencji...")
 
-    if genre_name == 'pop':
-        temperature = find_temperature(list(POP_GENERATION_VALUES.keys()), diversity)
-        noise = random.choice(POP_GENERATION_VALUES[temperature])
-    elif genre_name == 'rock':
-        temperature = find_temperature(list(ROCK_GENERATION_VALUES.keys()), diversity)
-        noise = random.choice(ROCK_GENERATION_VALUES[temperature])
-    elif genre_name == 'country':
-        temperature = find_temperature(list(COUNTRY_GENERATION_VALUES.keys()), diversity)
-        noise = random.choice(COUNTRY_GENERATION_VALUES[temperature])
-    else:
-        temperature = 2.0
-        noise = 0.01
+    # every candidate gets its own temperature/noise drawn for the same diversity level
+    temperatures, noises = zip(
+        *(choose_generation_values(genre_name, diversity, py_rng) for _ in range(candidates))
+    )
 
-    print(f"[INFO] Wylosowana temperatura: {temperature}, szum: {noise}")
+    logger.debug("Wylosowane temperatury: %s, szumy: %s", temperatures, noises)
+    annotate(genre=genre_label(genre_name), candidates=candidates, temperatures=temperatures, noises=noises)
 
-    while True:
+    # best complete candidate so far, returned if no attempt passes within max_attempts
+    best_events, best_ratio, best_index = None, -1.0, None
 
-        seed_sequence = generate_random_seed_sequence(
-            length=np.random.randint(1, 40),
-            input_dim=input_dim,
-            fixed_length=fixed_length
-        )
+    for attempt in range(1, max_attempts + 1):
+        # the last attempt always runs to the end so there is something to fall back on
+        early_rejection = attempt < max_attempts
 
-        # print(seed_sequence)
+        seed_sequences = [
+            generate_random_seed_sequence(
+                length=int(np_rng.integers(1, 40)),
+                input_dim=input_dim,
+                fixed_length=fixed_length,
+                rng=np_rng
+            )
+            for _ in range(candidates)
+        ]
 
-        midi_msgs = generate_sequence(
-            model,
-            seed_sequence,
+        batch = GenerationBatch(
+            seed_sequences,
             genre_vector,
             length=sequence_length,
             fixed_length=fixed_length,
-            temperature=temperature,
-            param_noise_std=noise
+            temperatures=temperatures,
+            param_noise_stds=noises,
+            progress=progress,
+            rng=np_rng,
+            min_note_ratio=min_note_ratio if early_rejection else None,
+            running_note_ratio=running_note_ratio if early_rejection else None,
+            warm_up_steps=warm_up_steps
         )
-        if not midi_msgs:
+
+        with stage('generate'):
+            if scheduler is not None and not incremental:
+                submitted = time.perf_counter()
+                scheduler.submit_batch(batch).result()
+                add_stage('scheduler_wait', batch.admitted_at - submitted)
+            else:
+                run_batch(model, batch, incremental)
+
+        steps = batch.steps_done * candidates
+        if batch.aborted:
+            logger.debug("Przerwano %d sekwencji po %d krokach — za mało note_on/note_off",
+                         candidates, batch.steps_done)
+            rejection_stats.record_attempt(genre_name, candidates, candidates, candidates, True, steps, steps)
             continue
 
-        note_messages = [msg for msg in midi_msgs if msg.type in ('note_on', 'note_off')]
-        note_ratio = len(note_messages) / len(midi_msgs)
+        index, ratio = select_candidate(batch.events, threshold=min_note_ratio, rejected=batch.rejected)
+        failing = batch.rejected | (event_note_ratios(batch.events) < min_note_ratio)
+        accepted = not failing[index]
+
+        rejection_stats.record_attempt(
+            genre_name,
+            candidates,
+            int(failing.sum()),
+            int(batch.rejected.sum()),
+            False,
+            steps,
+            steps - batch.total_steps if accepted else steps
+        )
+
+        if accepted:
+            logger.debug("Akceptowana sekwencja #%d (T=%s, szum=%s) — %.1f%% to note_on/note_off",
+                         index, temperatures[index], noises[index], ratio * 100)
+            rejection_stats.record_request(genre_name, fallback=False)
+            annotate(attempts=attempt, retries=attempt - 1, fallback=False, events=len(batch.events[index]),
+                     note_ratio=float(ratio), temperature=temperatures[index], noise=noises[index])
+            return batch.events[index], genre_vector
+
+        logger.debug("Odrzucono %d sekwencji — najlepsza ma tylko %.1f%% note_on/note_off", candidates, ratio * 100)
+        if ratio > best_ratio:
+            best_events, best_ratio, best_index = batch.events[index], ratio, index
+
+    logger.info("Wykorzystano %d prób — zwracam najlepszą sekwencję (%.1f%% note_on/note_off)",
+                max_attempts, best_ratio * 100)
+    rejection_stats.record_request(genre_name, fallback=True, fallback_steps=len(best_events))
+    annotate(attempts=max_attempts, retries=max_attempts - 1, fallback=True, events=len(best_events),
+             note_ratio=float(best_ratio), temperature=temperatures[best_index], noise=noises[best_index])
+    return best_events, genre_vector
+
+
+def finish_piece(
+        events,
+        genre_vector,
+        instrument=113,
+        output_path="ai_module/results/",
+        as_bytes=False,
+        archive=True,
+        rng=random
+):
+    """Turn generated events into a MidiFile (or its bytes) for an instrument, archiving it if asked.
+
+    The bytes are encoded straight from an EventSequence, mido messages are only built for a MidiFile.
+    """
+    with stage('decode'):
+        sequence = EventSequence.from_vectors(events)
+    with stage('serialize'):
+        midi_bytes = sequence.to_midi_bytes(instrument) if as_bytes or archive else None
+
+    if archive:
+        archive_writer.submit(output_path + generate_filename(genre_vector, rng), midi_bytes)
+
+    return midi_bytes if as_bytes else sequence.to_midi(instrument)
+
+
+def generate(
+        model_path=DEFAULT_MODEL_PATH,
+        output_path="ai_module/results/",
+        sequence_length=1000,
+        genre='undefined',
+        instrument=113,
+        diversity=Diversity.MEDIUM,
+        compiled_inference=True,
+        candidates=4,
+        scheduler=None,
+        incremental=False,
+        as_bytes=False,
+        archive=True,
+        progress=None,
+        seed=None,
+        min_note_ratio=0.5,
+        running_note_ratio=0.25,
+        warm_up_steps=100,
+        max_attempts=8
+):
+    """Generate a piece and return it as a MidiFile, or as Standard MIDI File bytes if as_bytes=True.
+
+    progress is called with (events_generated, sequence_length) while candidates are generated;
+    it starts over from zero when a whole batch of candidates is rejected.
+
+    A piece is accepted when at least min_note_ratio of its events are note_on/note_off.
+    Candidates are rejected while they are generated as soon as they can't reach that, or when
+    their ratio so far is below running_note_ratio after warm_up_steps events; a batch stops
+    as soon as all its candidates are rejected. After max_attempts batches the best complete
+    candidate is returned even if it doesn't pass.
+
+    Every request draws from its own RNGs, never the global ones. With an integer seed they are
+    seeded with it and the result is deterministic: genre, temperatures, seed sequences,
+    sampling and noise all come from them. Seeded requests don't go through the scheduler, so the
+    batch they share the model with can't change the floating point results. The archive filename
+    stays random, so seeded pieces of other lengths or instruments don't overwrite each other.
+
+    The piece is serialized at most once. With archive=True those bytes are also written to
+    output_path by a background writer, so the caller never waits on disk.
+
+    When a GenerationScheduler is given, the candidate batch is stepped together with other
+    in-flight requests instead of running its own loop. incremental=True uses the stateful
+    decoder and always runs on its own, since its batch size is fixed. It produces different
+    pieces, not just the same ones faster: the decoder conditions on the whole history instead
+    of the last 50 events the model was trained on, so outputs diverge after the first step.
+    """
+    if not os.path.exists(model_path):
+        logger.error("Model file not found.")
+        return
+
+    events, genre_vector = generate_piece(
+        model_path=model_path,
+        sequence_length=sequence_length,
+        genre=genre,
+        diversity=diversity,
+        compiled_inference=compiled_inference,
+        candidates=candidates,
+        scheduler=scheduler,
+        incremental=incremental,
+        progress=progress,
+        seed=seed,
+        min_note_ratio=min_note_ratio,
+        running_note_ratio=running_note_ratio,
+        warm_up_steps=warm_up_steps,
+        max_attempts=max_attempts
+    )
+
+    return finish_piece(
+        events,
+        genre_vector,
+        instrument=instrument,
+        output_path=output_path,
+        as_bytes=as_bytes,
+        archive=archive
+    )
 
-        if note_ratio >= 0.5:
-            print(f"[INFO] Akceptowana sekwencja — {note_ratio:.1%} to note_on/note_off")
-            break
-        else:
-            print(f"[INFO] Odrzucono sekwencję — tylko {note_ratio:.1%} to note_on/note_off")
 
-    return save_midi(midi_msgs, output_path + filename, instrument)
+def generate_stream(
+        model_path=DEFAULT_MODEL_PATH,
+        output_path="ai_module/results/",
+        sequence_length=1000,
+        genre='undefined',
+        instrument=113,
+        diversity=Diversity.MEDIUM,
+        archive=True
+):
+    """Yield the messages of a piece while it is being generated, instrument program changes first.
+
+    Delta times are in ticks of TICKS_PER_BEAT. Only one candidate is generated and there is no
+    note-ratio filter, because messages are already on their way to the client when the ratio
+    becomes known.
+    """
+    if not os.path.exists(model_path):
+        logger.error("Model file not found.")
+        return
+
+    with stage('load_model'):
+        engine = get_engine(model_path)
+    fixed_length = 50
+
+    rng, py_rng = make_rng(), random.Random()
+    genre_vector, genre_name = resolve_genre(genre, rng)
+    temperature, noise = choose_generation_values(genre_name, diversity, py_rng)
+    logger.debug("Wylosowana temperatura: %s, szum: %s", temperature, noise)
+    annotate(genre=genre_label(genre_name), temperature=temperature, noise=noise)
+
+    seed_sequence = generate_random_seed_sequence(
+        length=int(rng.integers(1, 40)), fixed_length=fixed_length, rng=rng
+    )
+    batch = GenerationBatch([seed_sequence], genre_vector, sequence_length, fixed_length, temperature, noise, rng=rng)
+
+    yield from instrument_messages(instrument)
+
+    # only the time spent generating counts, not the time the consumer takes between messages
+    generate_seconds = 0.0
+    while not batch.done:
+        start = time.perf_counter()
+        batch.advance(*engine.predict(batch.sequences, batch.genres))
+        generate_seconds += time.perf_counter() - start
+        yield decode_event_vectors(batch.events[0, batch.steps_done - 1:batch.steps_done])[0]
+
+    add_stage('generate', generate_seconds)
+    annotate(events=batch.steps_done)
+
+    if archive:
+        midi_bytes = EventSequence.from_vectors(batch.events[0]).to_midi_bytes(instrument)
+        archive_writer.submit(output_path + generate_filename(genre_vector, py_rng), midi_bytes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+SEQUENCE_INPUT = "sequence_input"
+GENRE_INPUT = "genre_input"
+
+
+class Engine:
+    """What generation needs from an inference backend.
+
+    predict() runs one forward step for a (B, fixed_length, input_dim) batch of windows and
+    (B, genre_dim) genre vectors and returns (event type probabilities, params) as numpy arrays.
+    Backends that can't keep recurrent state between calls leave stateful_decoder() as is, so
+    incremental decoding raises ValueError with them.
+    """
+
+    fixed_length = None
+    input_dim = None
+    genre_dim = None
+
+    def predict(self, sequence, genre):
+        raise NotImplementedError
+
+    def stateful_decoder(self, batch_size=1):
+        raise ValueError(f"Incremental decoding is not supported by {type(self).__name__}")
+
+    def warm_up(self):
+        sequence = np.zeros((1, self.fixed_length, self.input_dim), dtype=np.float32)
+        genre = np.zeros((1, self.genre_dim), dtype=np.float32)
+        self.predict(sequence, genre)
+
+
+class InferenceEngine(Engine):
+    """Runs single forward steps of the composer model with TensorFlow.
+
+    With compiled=True the model is called through a traced tf.function, which skips the
+    data adapter and callback setup that model.predict does on every call. compiled=False
+    keeps the old model.predict path.
+    """
+
+    def __init__(self, model, compiled=True):
+        self.model = model
+        self.compiled = compiled
+
+        _, self.fixed_length, self.input_dim = model.get_layer(SEQUENCE_INPUT).output.shape
+        self.genre_dim = model.get_layer(GENRE_INPUT).output.shape[-1]
+
+        self._decoders = {}
+        self._decoders_lock = threading.Lock()
+
+        if compiled:
+            import tensorflow as tf
+
+            # batch dimension is left open so batched generation reuses the same trace
+            self._step = tf.function(
+                self._call_model,
+                input_signature=[
+                    tf.TensorSpec((None, self.fixed_length, self.input_dim), tf.float32),
+                    tf.TensorSpec((None, self.genre_dim), tf.float32),
+                ]
+            )
+
+    def _call_model(self, sequence, genre):
+        y_type, y_params = self.model({SEQUENCE_INPUT: sequence, GENRE_INPUT: genre}, training=False)
+        return y_type, y_params
+
+    def predict(self, sequence, genre):
+        """Predict event type probabilities and params for a (B, fixed_length, input_dim) batch."""
+        sequence = np.asarray(sequence, dtype=np.float32)
+        genre = np.asarray(genre, dtype=np.float32)
+
+        if not self.compiled:
+            return self.model.predict({SEQUENCE_INPUT: sequence, GENRE_INPUT: genre}, verbose=0)
+
+        y_type, y_params = self._step(sequence, genre)
+        return y_type.numpy(), y_params.numpy()
+
+    @contextmanager
+    def stateful_decoder(self, batch_size=1):
+        """Check out a stateful single-timestep copy of the model for a fixed batch size.
+
+        Decoders hold per-sequence state, so each one is used by one generation at a time and
+        returned to a pool afterwards; new ones are only built when all are in use.
+        """
+        with self._decoders_lock:
+            free = self._decoders.setdefault(batch_size, [])
+            decoder = free.pop() if free else None
+
+        if decoder is None:
+            decoder = StatefulDecoder(self.model, batch_size)
+
+        try:
+            yield decoder
+        finally:
+            with self._decoders_lock:
+                self._decoders[batch_size].append(decoder)
+
+
+def build_stateful_model(model, batch_size=1):
+    """Rebuild the model with a one-timestep sequence input and stateful recurrent layers.
+
+    The clone shares the trained weights. Only models whose layers work one timestep at a time
+    (plain RNN layers, Dense, Concatenate, ...) can be converted; layers that need the whole
+    window, such as Bidirectional or Flatten, raise ValueError.
+    """
+    from tensorflow import keras
+
+    _, _, input_dim = model.get_layer(SEQUENCE_INPUT).output.shape
+    genre_dim = model.get_layer(GENRE_INPUT).output.shape[-1]
+
+    def clone_layer(layer):
+        if isinstance(layer, (keras.layers.Bidirectional, keras.layers.Flatten, keras.layers.RepeatVector)):
+            raise ValueError(f"Layer {layer.name} ({type(layer).__name__}) can't be decoded incrementally")
+
+        config = layer.get_config()
+        if isinstance(layer, keras.layers.RNN):
+            config['stateful'] = True
+        return layer.__class__.from_config(config)
+
+    inputs = {
+        SEQUENCE_INPUT: keras.Input(batch_shape=(batch_size, 1, input_dim), name=SEQUENCE_INPUT),
+        GENRE_INPUT: keras.Input(batch_shape=(batch_size, genre_dim), name=GENRE_INPUT),
+    }
+    if isinstance(model.input, dict):
+        input_tensors = inputs
+    else:
+        input_tensors = [inputs[tensor.name.split(':')[0]] for tensor in model.inputs]
+
+    stateful_model = keras.models.clone_model(model, input_tensors=input_tensors, clone_function=clone_layer)
+    stateful_model.set_weights(model.get_weights())
+    return stateful_model
+
+
+class StatefulDecoder:
+    """Advances the model one event at a time, keeping the recurrent state between calls.
+
+    prime() runs the padded seed window through the recurrent layers once; after that every
+    step() costs a single timestep instead of the full fixed_length window.
+    """
+
+    def __init__(self, model, batch_size=1):
+        import tensorflow as tf
+
+        self.batch_size = batch_size
+        self.model = build_stateful_model(model, batch_size)
+        self._recurrent_layers = [layer for layer in self.model.layers if getattr(layer, 'stateful', False)]
+
+        input_dim = self.model.get_layer(SEQUENCE_INPUT).output.shape[-1]
+        genre_dim = self.model.get_layer(GENRE_INPUT).output.shape[-1]
+        self._step = tf.function(
+            self._call_model,
+            input_signature=[
+                tf.TensorSpec((batch_size, 1, input_dim), tf.float32),
+                tf.TensorSpec((batch_size, genre_dim), tf.float32),
+            ]
+        )
+
+    def _call_model(self, event, genre):
+        y_type, y_params = self.model({SEQUENCE_INPUT: event, GENRE_INPUT: genre}, training=False)
+        return y_type, y_params
+
+    def reset(self):
+        for layer in self._recurrent_layers:
+            layer.reset_states()
+
+    def step(self, events, genre):
+        """Feed a (batch_size, 1, input_dim) event batch, return predictions for the next event."""
+        y_type, y_params = self._step(np.asarray(events, dtype=np.float32), np.asarray(genre, dtype=np.float32))
+        return y_type.numpy(), y_params.numpy()
+
+    def prime(self, sequences, genre):
+        """Reset the state and run a (batch_size, window, input_dim) window through it."""
+        self.reset()
+        outputs = None
+        for t in range(sequences.shape[1]):
+            outputs = self.step(sequences[:, t:t + 1], genre)
+        return outputs
+
+
+def as_engine(model, compiled=True):
+    if isinstance(model, Engine):
+        return model
+    return InferenceEngine(model, compiled=compiled)
@@ -0,0 +1,244 @@
+import hashlib
+import importlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from ai_module.inference import InferenceEngine
+from inference_backend import InferenceBackend
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ModelEntry:
+    model: object
+    path: str
+    mtime: float
+    load_time: float
+    weights_bytes: int
+    loaded_at: float
+    engines: dict = field(default_factory=dict)
+
+
+def weights_footprint(model):
+    return int(sum(weight.numpy().nbytes for weight in model.weights))
+
+
+@dataclass
+class BackendEntry:
+    engine: object
+    path: str
+    backend: str
+    mtime: float
+    load_time: float
+    loaded_at: float
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded models keyed by absolute path and file mtime.
+
+    get_engine() uses `backend` unless it is given one. Engines of other backends than
+    tensorflow are built by the module registered for them in backend_modules and cached here
+    as well; the Keras model itself is only loaded if that module needs it.
+    """
+
+    def __init__(self, backend=InferenceBackend.TENSORFLOW):
+        self.backend = backend
+        self._entries = {}
+        self._backend_entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_path):
+        return self._get_entry(model_path).model
+
+    def get_engine(self, model_path, compiled=True, backend=None):
+        backend = backend or self.backend
+        if backend != InferenceBackend.TENSORFLOW:
+            return self._get_backend_entry(model_path, backend).engine
+
+        entry = self._get_entry(model_path)
+
+        engine = entry.engines.get(compiled)
+        if engine is None:
+            with self._lock:
+                engine = entry.engines.get(compiled)
+                if engine is None:
+                    engine = InferenceEngine(entry.model, compiled=compiled)
+                    engine.warm_up()
+                    entry.engines[compiled] = engine
+        return engine
+
+    def _get_entry(self, model_path):
+        path = os.path.abspath(model_path)
+        mtime = os.path.getmtime(path)
+
+        entry = self._entries.get(path)
+        if entry is not None and entry.mtime == mtime:
+            return entry
+
+        with self._lock:
+            # another thread may have loaded it while we were waiting
+            entry = self._entries.get(path)
+            if entry is not None and entry.mtime == mtime:
+                return entry
+
+            if entry is not None:
+                logger.info("Model changed on disk, reloading: %s", path)
+
+            entry = self._load(path, mtime)
+            self._entries[path] = entry
+            return entry
+
+    def _get_backend_entry(self, model_path, backend):
+        path = os.path.abspath(model_path)
+        mtime = os.path.getmtime(path)
+
+        entry = self._backend_entries.get((path, backend))
+        if entry is not None and entry.mtime == mtime:
+            return entry
+
+        with self._lock:
+            entry = self._backend_entries.get((path, backend))
+            if entry is not None and entry.mtime == mtime:
+                return entry
+
+            start = time.perf_counter()
+            engine = load_backend_engine(path, backend)
+            engine.warm_up()
+            entry = BackendEntry(
+                engine=engine,
+                path=path,
+                backend=backend,
+                mtime=mtime,
+                load_time=time.perf_counter() - start,
+                loaded_at=time.time()
+            )
+            logger.info("Loaded %s engine for %s in %.2fs", backend, path, entry.load_time)
+            self._backend_entries[(path, backend)] = entry
+            return entry
+
+    def _load(self, path, mtime):
+        # tensorflow is only imported once a model is actually needed
+        from tensorflow.keras.models import load_model
+
+        start = time.perf_counter()
+        model = load_model(path)
+        load_time = time.perf_counter() - start
+
+        entry = ModelEntry(
+            model=model,
+            path=path,
+            mtime=mtime,
+            load_time=load_time,
+            weights_bytes=weights_footprint(model),
+            loaded_at=time.time()
+        )
+        logger.info("Loaded model %s in %.2fs (%.1f MB of weights)", path, load_time, entry.weights_bytes / 1024 / 1024)
+        return entry
+
+    def warm_up(self, model_paths):
+        for model_path in model_paths:
+            if not os.path.exists(model_path):
+                logger.error("Cannot warm up, model file not found: %s", model_path)
+                continue
+            self.get_engine(model_path)
+
+    def is_warm(self, model_path, backend=None):
+        """Whether get_engine(model_path) would return a warmed up engine without loading anything."""
+        backend = backend or self.backend
+        path = os.path.abspath(model_path)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return False
+
+        if backend != InferenceBackend.TENSORFLOW:
+            entry = self._backend_entries.get((path, backend))
+            return entry is not None and entry.mtime == mtime
+
+        entry = self._entries.get(path)
+        return entry is not None and entry.mtime == mtime and bool(entry.engines)
+
+    def evict(self, model_path):
+        path = os.path.abspath(model_path)
+        with self._lock:
+            self._entries.pop(path, None)
+            for key in [key for key in self._backend_entries if key[0] == path]:
+                del self._backend_entries[key]
+
+    def stats(self):
+        return [
+            {
+                'path': entry.path,
+                'backend': InferenceBackend.TENSORFLOW,
+                'mtime': entry.mtime,
+                'load_time_seconds': entry.load_time,
+                'weights_bytes': entry.weights_bytes,
+                'loaded_at': entry.loaded_at,
+            }
+            for entry in list(self._entries.values())
+        ] + [
+            {
+                'path': entry.path,
+                'backend': entry.backend,
+                'mtime': entry.mtime,
+                'load_time_seconds': entry.load_time,
+                'loaded_at': entry.loaded_at,
+            }
+            for entry in list(self._backend_entries.values())
+        ]
+
+
+# modules providing load_engine(model_path, backend) -> Engine for the non-tensorflow backends,
+# imported only when their backend is used
+backend_modules = {
+    InferenceBackend.TFLITE_DYNAMIC: 'ai_module.tflite_engine',
+    InferenceBackend.TFLITE_FLOAT16: 'ai_module.tflite_engine',
+    InferenceBackend.ONNX: 'ai_module.onnx_engine',
+}
+
+
+def register_backend(backend, module_name):
+    """Make another inference backend available to get_engine(), see backend_modules."""
+    backend_modules[backend] = module_name
+
+
+def load_backend_engine(model_path, backend):
+    module_name = backend_modules.get(backend)
+    if module_name is None:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    return importlib.import_module(module_name).load_engine(model_path, backend)
+
+
+registry = ModelRegistry()
+
+_file_hashes = {}
+
+
+def model_file_hash(model_path):
+    """sha256 of the model file, recomputed only when its mtime changes."""
+    path = os.path.abspath(model_path)
+    mtime = os.path.getmtime(path)
+
+    cached = _file_hashes.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(block)
+
+    _file_hashes[path] = (mtime, sha256.hexdigest())
+    return _file_hashes[path][1]
+
+
+def get_model(model_path):
+    return registry.get(model_path)
+
+
+def get_engine(model_path, compiled=True, backend=None):
+    return registry.get_engine(model_path, compiled, backend)
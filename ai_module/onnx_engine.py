@@ -0,0 +1,120 @@
+"""Inference with ONNX Runtime, so generation can run without importing TensorFlow.
+
+The .onnx file is never created at runtime, because that would need TensorFlow. Export it
+offline, in an environment with tensorflow and tf2onnx, from the repository root:
+
+    python -m ai_module.onnx_engine --model ai_module/model/final_model_3.keras
+"""
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from ai_module.inference import GENRE_INPUT, SEQUENCE_INPUT, Engine
+
+logger = logging.getLogger(__name__)
+
+try:
+    import onnxruntime
+except ImportError:
+    # onnxruntime is only needed with AI_COMPOSER_INFERENCE_BACKEND=onnx
+    onnxruntime = None
+
+OPSET = 17
+
+# threads per session, set by generation workers to the size of their CPU share
+intra_op_threads = None
+
+
+def onnx_model_path(model_path):
+    return f"{os.path.splitext(model_path)[0]}.onnx"
+
+
+def export_onnx(model_path, output_path=None, opset=OPSET):
+    """Export a .keras model to ONNX with an open batch dimension, returns the output path."""
+    import tensorflow as tf
+    import tf2onnx
+    from tensorflow.keras.models import load_model
+
+    output_path = output_path or onnx_model_path(model_path)
+    model = load_model(model_path)
+
+    _, fixed_length, input_dim = model.get_layer(SEQUENCE_INPUT).output.shape
+    genre_dim = model.get_layer(GENRE_INPUT).output.shape[-1]
+    input_signature = [
+        tf.TensorSpec((None, fixed_length, input_dim), tf.float32, name=SEQUENCE_INPUT),
+        tf.TensorSpec((None, genre_dim), tf.float32, name=GENRE_INPUT),
+    ]
+
+    @tf.function(input_signature=input_signature)
+    def serve(sequence_input, genre_input):
+        y_type, y_params = model({SEQUENCE_INPUT: sequence_input, GENRE_INPUT: genre_input}, training=False)
+        return y_type, y_params
+
+    start = time.perf_counter()
+    tmp_path = output_path + '.part'
+    tf2onnx.convert.from_function(serve, input_signature=input_signature, opset=opset, output_path=tmp_path)
+    os.replace(tmp_path, output_path)
+
+    logger.info("Exported %s to %s in %.1fs", model_path, output_path, time.perf_counter() - start)
+    return output_path
+
+
+class OnnxEngine(Engine):
+    """Engine running an exported .onnx model in an ONNX Runtime session.
+
+    A session can be run from several threads at once, so one is shared by all generations.
+    """
+
+    def __init__(self, onnx_path, intra_op_threads=None):
+        if onnxruntime is None:
+            raise RuntimeError("onnxruntime is not installed, install requirements-onnx.txt")
+
+        options = onnxruntime.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+        # tf2onnx may suffix names with the tensor index
+        inputs = {node.name.split(':')[0]: node for node in self.session.get_inputs()}
+        self._sequence_name = inputs[SEQUENCE_INPUT].name
+        self._genre_name = inputs[GENRE_INPUT].name
+        _, self.fixed_length, self.input_dim = inputs[SEQUENCE_INPUT].shape
+        self.genre_dim = inputs[GENRE_INPUT].shape[-1]
+
+    def predict(self, sequence, genre):
+        y_type, y_params = self.session.run(None, {
+            self._sequence_name: np.asarray(sequence, dtype=np.float32),
+            self._genre_name: np.asarray(genre, dtype=np.float32),
+        })
+        return y_type, y_params
+
+
+def load_engine(model_path, backend=None):
+    path = onnx_model_path(model_path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, export it with: python -m ai_module.onnx_engine --model {model_path}")
+    if os.path.getmtime(path) < os.path.getmtime(model_path):
+        raise RuntimeError(f"{path} is older than {model_path}, export it again")
+
+    return OnnxEngine(path, intra_op_threads=intra_op_threads)
+
+
+def main():
+    from ai_module.generator import DEFAULT_MODEL_PATH
+    from ai_module.tracing import configure_logging
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--output')
+    parser.add_argument('--opset', type=int, default=OPSET)
+    args = parser.parse_args()
+    configure_logging()
+
+    export_onnx(args.model, args.output, args.opset)
+
+
+if __name__ == '__main__':
+    main()
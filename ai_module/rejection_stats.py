@@ -0,0 +1,57 @@
+import threading
+from collections import defaultdict
+
+
+class RejectionStats:
+    """Per-genre counts of candidates rejected by the note ratio check and the steps they cost.
+
+    wasted_steps are generated events of candidates that were not returned, including the rest
+    of the batch of an accepted candidate.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._genres = defaultdict(lambda: {
+            'requests': 0,
+            'attempts': 0,
+            'candidates': 0,
+            'rejected_candidates': 0,
+            'aborted_candidates': 0,
+            'aborted_attempts': 0,
+            'fallbacks': 0,
+            'steps': 0,
+            'wasted_steps': 0,
+        })
+
+    def record_attempt(self, genre, candidates, rejected, aborted, batch_aborted, steps, wasted_steps):
+        with self._lock:
+            counts = self._genres[genre]
+            counts['attempts'] += 1
+            counts['candidates'] += candidates
+            counts['rejected_candidates'] += rejected
+            counts['aborted_candidates'] += aborted
+            counts['aborted_attempts'] += int(batch_aborted)
+            counts['steps'] += steps
+            counts['wasted_steps'] += wasted_steps
+
+    def record_request(self, genre, fallback, fallback_steps=0):
+        """fallback_steps are the steps of a returned fallback candidate, already counted as wasted."""
+        with self._lock:
+            counts = self._genres[genre]
+            counts['requests'] += 1
+            counts['fallbacks'] += int(fallback)
+            counts['wasted_steps'] -= fallback_steps
+
+    def stats(self):
+        with self._lock:
+            return {
+                genre: {
+                    **counts,
+                    'rejection_rate': counts['rejected_candidates'] / counts['candidates'] if counts['candidates'] else 0.0,
+                    'wasted_step_fraction': counts['wasted_steps'] / counts['steps'] if counts['steps'] else 0.0,
+                }
+                for genre, counts in self._genres.items()
+            }
+
+
+rejection_stats = RejectionStats()
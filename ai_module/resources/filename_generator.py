@@ -33,14 +33,14 @@ adjectives = [
 emojis = ['🔥', '🎸', '🐴', '🌈', '💀', '👢', '😩', '👑', '🎤', '🚀', '🤠', '💅', '🛸']
 
 
-def generate_filename(genre_vector):
+def generate_filename(genre_vector, rng=random):
     genre_key = tuple(int(x) for x in genre_vector[:3].tolist())
     genre = reversed_genre_dict.get(genre_key, 'unknown')
 
     words = genre_parts.get(genre, genre_parts['unknown'])
-    name_parts = random.sample(words, 2)
-    adjective = random.choice(adjectives)
-    emoji = random.choice(emojis)
+    name_parts = rng.sample(words, 2)
+    adjective = rng.choice(adjectives)
+    emoji = rng.choice(emojis)
 
     filename = f"{genre}_{adjective}_{name_parts[0]}_{name_parts[1]}_{emoji}.mid"
     return filename
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def make_rng(seed=None):
+    """A numpy Generator for one request, seeded from the OS when seed is None.
+
+    Every request draws from its own Generator, so concurrent requests never share RNG state and
+    a seeded one gives the same numbers no matter what runs next to it.
+    """
+    return np.random.default_rng(seed)
+
+
+def sample_with_temperature(probs, temperatures, uniforms):
+    """Sample one event type index per row of a (B, n_types) probability batch.
+
+    Softmax of log(probs) / temperature, shifted by the row max so exp can't overflow, then an
+    inverse CDF lookup of uniforms (B values in [0, 1)). Unlike rng.choice the probabilities are
+    not validated again on every call.
+    """
+    logits = np.log(np.clip(probs, 1e-8, 1.0))
+    logits /= temperatures[:, None]
+    logits -= logits.max(axis=1, keepdims=True)
+    cdf = np.cumsum(np.exp(logits), axis=1)
+    targets = uniforms * cdf[:, -1]
+    return np.minimum((cdf < targets[:, None]).sum(axis=1), probs.shape[1] - 1)
+
+
+class SamplingStream:
+    """All random draws of a batch of sequences, made in two calls before generation starts.
+
+    uniforms[step] picks the event types of a step and noise[step] is the parameter noise,
+    already scaled by each row's standard deviation.
+    """
+
+    def __init__(self, rng, batch_size, steps, n_params, noise_stds):
+        self.uniforms = rng.random((steps, batch_size))
+        self.noise = rng.standard_normal((steps, batch_size, n_params), dtype=np.float32)
+        self.noise *= np.asarray(noise_stds, dtype=np.float32).reshape(1, batch_size, 1)
@@ -0,0 +1,201 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from ai_module.generator import GenerationBatch
+from ai_module.model_registry import get_engine
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationScheduler:
+    """Continuous batching of concurrent generation requests.
+
+    A single worker thread owns the model. Every step it runs one forward pass over the rows of
+    all active requests; requests join between steps when there is room and leave as soon as
+    their sequences are complete. When idle, the first request waits up to max_wait seconds so
+    that requests arriving together start in the same batch.
+    """
+
+    def __init__(self, model_path, max_batch_size=32, max_wait=0.005, compiled=True):
+        self.model_path = model_path
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.compiled = compiled
+
+        self._pending = queue.Queue()
+        self._waiting = deque()
+        self._active = []
+
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._steps = 0
+        self._rows_stepped = 0
+        self._batch_sizes = Counter()
+        self._completed = 0
+        self._failed = 0
+
+    def submit(
+            self,
+            seed_sequences,
+            genre_vector,
+            length=500,
+            fixed_length=50,
+            temperatures=0.01,
+            param_noise_stds=0.001,
+            progress=None,
+            rng=None
+    ):
+        """Queue a batch of seeds; the returned Future resolves to the (B, length, 11) event array.
+
+        progress is called from the scheduler thread after every step.
+        """
+        return self.submit_batch(GenerationBatch(
+            seed_sequences, genre_vector, length, fixed_length, temperatures, param_noise_stds, progress, rng
+        ))
+
+    def submit_batch(self, batch):
+        """Queue an already built GenerationBatch; the Future resolves to its event array.
+
+        A batch that stops early because all its rows were rejected leaves the shared batch
+        at that step like a finished one.
+        """
+        future = Future()
+        self._ensure_running()
+        self._pending.put((batch, future))
+        return future
+
+    def generate(self, seed_sequences, genre_vector, **kwargs):
+        return self.submit(seed_sequences, genre_vector, **kwargs).result()
+
+    def _ensure_running(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='generation-scheduler', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if not self._active and not self._waiting:
+                    self._waiting.append(self._pending.get())
+                    self._drain_pending(self.max_wait)
+                else:
+                    self._drain_pending(0)
+
+                self._admit()
+                if self._active:
+                    self._step()
+            except Exception as e:
+                # an error outside a batch's own step would otherwise repeat on every restart of the thread
+                failing = len(self._active) + len(self._waiting)
+                logger.exception("Generation scheduler failed, failing %d requests", failing)
+                self._fail([*self._active, *self._waiting], e)
+                self._active = []
+                self._waiting.clear()
+
+    def _fail(self, items, error):
+        failed = 0
+        for _, future in items:
+            if not future.done():
+                future.set_exception(error)
+                failed += 1
+        with self._stats_lock:
+            self._failed += failed
+
+    def _drain_pending(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self._rows(self._active) + self._rows(self._waiting) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._pending.get(timeout=remaining)
+                else:
+                    item = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            self._waiting.append(item)
+
+    def _admit(self):
+        while self._waiting:
+            batch, future = self._waiting[0]
+            # a request bigger than max_batch_size still runs, just on its own
+            if self._active and self._rows(self._active) + batch.batch_size > self.max_batch_size:
+                break
+            self._waiting.popleft()
+            batch.admitted_at = time.perf_counter()
+
+            if batch.done:
+                future.set_result(batch.events)
+            elif future.set_running_or_notify_cancel():
+                self._active.append((batch, future))
+
+    def _step(self):
+        active = self._active
+        sequences = np.concatenate([batch.sequences for batch, _ in active])
+        genres = np.concatenate([batch.genres for batch, _ in active])
+
+        try:
+            y_type_logits, y_params = get_engine(self.model_path, self.compiled).predict(sequences, genres)
+        except Exception as e:
+            logger.error("Generation step failed for %d requests: %s", len(active), e)
+            self._fail(active, e)
+            self._active = []
+            return
+
+        still_active = []
+        completed = 0
+        offset = 0
+        for batch, future in active:
+            rows = slice(offset, offset + batch.batch_size)
+            offset += batch.batch_size
+
+            # a failing batch, e.g. its progress callback raised, only fails its own request
+            try:
+                batch.advance(y_type_logits[rows], y_params[rows])
+            except Exception as e:
+                logger.error("Generation step failed for a request of %d rows: %s", batch.batch_size, e)
+                self._fail([(batch, future)], e)
+                continue
+
+            if batch.done:
+                future.set_result(batch.events)
+                completed += 1
+            else:
+                still_active.append((batch, future))
+
+        self._active = still_active
+
+        with self._stats_lock:
+            self._steps += 1
+            self._rows_stepped += len(sequences)
+            self._batch_sizes[len(sequences)] += 1
+            self._completed += completed
+
+    @staticmethod
+    def _rows(items):
+        return sum(batch.batch_size for batch, _ in items)
+
+    def stats(self):
+        with self._stats_lock:
+            steps = self._steps
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_seconds': self.max_wait,
+                'steps': steps,
+                'rows_stepped': self._rows_stepped,
+                'mean_batch_size': self._rows_stepped / steps if steps else 0.0,
+                'mean_occupancy': self._rows_stepped / (steps * self.max_batch_size) if steps else 0.0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'active_requests': len(self._active),
+                'queued_requests': self._pending.qsize() + len(self._waiting),
+                'completed_requests': self._completed,
+                'failed_requests': self._failed,
+            }
@@ -0,0 +1,197 @@
+"""Reduced-precision inference through the TensorFlow Lite interpreter.
+
+The .keras model is converted once to a .tflite file next to it, with dynamic-range int8 or
+float16 weights, and reconverted when the .keras file is newer. Converting needs TensorFlow;
+running only needs tflite_runtime if it is installed.
+
+Convert ahead of time, e.g. while building the image, from the repository root:
+
+    python -m ai_module.tflite_engine --backend tflite-dynamic
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from ai_module.inference import GENRE_INPUT, SEQUENCE_INPUT, Engine
+from inference_backend import InferenceBackend
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    # tflite_runtime is optional, the interpreter bundled with tensorflow is used without it
+    Interpreter = None
+
+SIGNATURE = 'serving_default'
+TYPE_OUTPUT = 'event_type'
+PARAMS_OUTPUT = 'params'
+
+
+def tflite_model_path(model_path, backend):
+    return f"{os.path.splitext(model_path)[0]}.{backend}.tflite"
+
+
+def convert_to_tflite(model, backend):
+    """Convert a loaded Keras model, returns the .tflite flatbuffer bytes."""
+    import tensorflow as tf
+
+    _, fixed_length, input_dim = model.get_layer(SEQUENCE_INPUT).output.shape
+    genre_dim = model.get_layer(GENRE_INPUT).output.shape[-1]
+
+    # batch dimension is left open, interpreters are resized per batch size
+    @tf.function(input_signature=[
+        tf.TensorSpec((None, fixed_length, input_dim), tf.float32, name=SEQUENCE_INPUT),
+        tf.TensorSpec((None, genre_dim), tf.float32, name=GENRE_INPUT),
+    ])
+    def serve(sequence_input, genre_input):
+        y_type, y_params = model({SEQUENCE_INPUT: sequence_input, GENRE_INPUT: genre_input}, training=False)
+        return {TYPE_OUTPUT: y_type, PARAMS_OUTPUT: y_params}
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([serve.get_concrete_function()], model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if backend == InferenceBackend.TFLITE_FLOAT16:
+        converter.target_spec.supported_types = [tf.float16]
+    elif backend != InferenceBackend.TFLITE_DYNAMIC:
+        raise ValueError(f"Not a TFLite backend: {backend}")
+
+    return converter.convert()
+
+
+def ensure_converted(model_path, backend):
+    """Path of the .tflite file for the model, converting it first if it is missing or stale."""
+    path = tflite_model_path(model_path, backend)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(model_path):
+        return path
+
+    from tensorflow.keras.models import load_model
+
+    start = time.perf_counter()
+    content = convert_to_tflite(load_model(model_path), backend)
+
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+    logger.info("Converted %s to %s in %.1fs (%.1f MB)",
+                model_path, path, time.perf_counter() - start, len(content) / 1024 / 1024)
+    return path
+
+
+def _create_interpreter(model_path, num_threads):
+    if Interpreter is not None:
+        return Interpreter(model_path=model_path, num_threads=num_threads)
+
+    import tensorflow as tf
+    return tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+
+
+class TFLiteEngine(Engine):
+    """Engine running a converted .tflite model.
+
+    Interpreters aren't thread safe, so each predict() checks one out of a pool of at most
+    max_interpreters, waiting when all of them are in use. Every interpreter holds its own copy of
+    the model. A checked out interpreter is resized when its last batch size differs, which only
+    reallocates its tensors, so the batch sizes of the scheduler don't add interpreters.
+    """
+
+    def __init__(self, model_path, num_threads=None, max_interpreters=2):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.max_interpreters = max_interpreters
+
+        # idle (batch size, runner) pairs
+        self._free = []
+        self._created = 0
+        self._condition = threading.Condition()
+
+        # shapes come from the signature, with the open batch dimension as -1
+        with self._runner(1) as runner:
+            details = runner.get_input_details()
+        _, self.fixed_length, self.input_dim = details[SEQUENCE_INPUT]['shape_signature']
+        self.genre_dim = details[GENRE_INPUT]['shape_signature'][-1]
+
+    def _new_runner(self):
+        interpreter = _create_interpreter(self.model_path, self.num_threads)
+        return interpreter.get_signature_runner(SIGNATURE)
+
+    @staticmethod
+    def _resize(runner, batch_size):
+        details = runner.get_input_details()
+        for name in (SEQUENCE_INPUT, GENRE_INPUT):
+            runner.resize_input(name, [batch_size, *details[name]['shape_signature'][1:]])
+        runner.allocate_tensors()
+
+    def _checkout(self, batch_size):
+        """An idle (batch size, runner), preferring one already sized for batch_size; (None, None) to create one."""
+        with self._condition:
+            while True:
+                if self._free:
+                    index = next((i for i, (size, _) in enumerate(self._free) if size == batch_size), -1)
+                    return self._free.pop(index)
+                if self._created < self.max_interpreters:
+                    self._created += 1
+                    return None, None
+                self._condition.wait()
+
+    def _checkin(self, batch_size, runner):
+        with self._condition:
+            if runner is None:
+                self._created -= 1
+            else:
+                self._free.append((batch_size, runner))
+            self._condition.notify()
+
+    @contextmanager
+    def _runner(self, batch_size):
+        size, runner = self._checkout(batch_size)
+        try:
+            if runner is None:
+                runner = self._new_runner()
+            if size != batch_size:
+                size = None
+                self._resize(runner, batch_size)
+                size = batch_size
+            yield runner
+        finally:
+            # a runner whose resize failed is checked in without a size, so the next checkout resizes it
+            self._checkin(size, runner)
+
+    def predict(self, sequence, genre):
+        sequence = np.asarray(sequence, dtype=np.float32)
+        genre = np.asarray(genre, dtype=np.float32)
+
+        with self._runner(len(sequence)) as runner:
+            outputs = runner(**{SEQUENCE_INPUT: sequence, GENRE_INPUT: genre})
+        return outputs[TYPE_OUTPUT], outputs[PARAMS_OUTPUT]
+
+
+def load_engine(model_path, backend, num_threads=None):
+    return TFLiteEngine(ensure_converted(model_path, backend), num_threads=num_threads)
+
+
+def main():
+    from ai_module.generator import DEFAULT_MODEL_PATH
+    from ai_module.tracing import configure_logging
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument(
+        '--backend',
+        choices=[InferenceBackend.TFLITE_DYNAMIC, InferenceBackend.TFLITE_FLOAT16],
+        default=InferenceBackend.TFLITE_DYNAMIC
+    )
+    args = parser.parse_args()
+    configure_logging()
+
+    print(ensure_converted(args.model, InferenceBackend(args.backend)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Per-request traces of generation stages, aggregated into latency histograms for /metrics.
+
+A request runs inside start_trace(). Code on the request's thread times its stages with
+stage() and adds attributes with annotate(); both do nothing when no trace is active, as in
+composition pool refills or the scheduler thread. A streamed response makes its trace current
+with use_trace() while it produces each chunk. A finished trace is logged as one JSON line
+on the ai_module.tracing logger at DEBUG level and its timings go into the histograms.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# seconds, a 1000 event piece with retries can take a minute or more on CPU
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+ATTEMPT_BUCKETS = (1, 2, 3, 4, 6, 8)
+NOTE_RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+def configure_logging(level=None):
+    """Log to stderr at AI_COMPOSER_LOG_LEVEL (INFO by default); DEBUG adds per-attempt details and traces."""
+    level = level or os.environ.get('AI_COMPOSER_LOG_LEVEL', 'INFO')
+    logging.basicConfig(level=level.upper(), format='[%(levelname)s] %(name)s: %(message)s')
+
+
+class Trace:
+    """Stage timings and attributes of one request; a stage that runs more than once adds up."""
+
+    def __init__(self, operation, **attributes):
+        self.operation = operation
+        self.attributes = attributes
+        self.stages = defaultdict(float)
+        self.error = None
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def add_stage(self, name, seconds):
+        self.stages[name] += seconds
+
+    def merge(self, trace_info):
+        """Add the stages and attributes of a to_dict() from another process."""
+        for name, seconds in trace_info['stages'].items():
+            self.add_stage(name, seconds)
+        self.attributes.update(trace_info['attributes'])
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {
+            'operation': self.operation,
+            'duration': self.duration,
+            'error': self.error,
+            'stages': dict(self.stages),
+            'attributes': self.attributes,
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def start_trace(operation, record=True, **attributes):
+    """Trace the body as one request. record=False only collects, e.g. in a worker process."""
+    trace = Trace(operation, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+        if record:
+            record_trace(trace)
+
+
+@contextlib.contextmanager
+def use_trace(trace):
+    """Make an existing trace current for the body, e.g. while a streamed response produces a chunk."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record_trace(trace):
+    metrics.observe(trace)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(trace.to_dict(), default=str))
+
+
+@contextlib.contextmanager
+def stage(name):
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, time.perf_counter() - start)
+
+
+def add_stage(name, seconds):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(name, seconds)
+
+
+def annotate(**attributes):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, **extra):
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [count per bucket..., sum, count]
+        self._series = {}
+
+    def observe(self, label_values, value):
+        series = self._series.setdefault(tuple(label_values), [0] * len(self.buckets) + [0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, label_values, le=bound)} {count}')
+            lines.append(f'{self.name}_bucket{_labels(self.label_names, label_values, le="+Inf")} {series[-1]}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, label_values)} {series[-2]}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, label_values)} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values = defaultdict(float)
+
+    def inc(self, label_values, amount=1):
+        self._values[tuple(label_values)] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+class TraceMetrics:
+    """Histograms and counters of finished traces, in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter(
+            'ai_composer_requests_total', 'Traced requests.', ('operation', 'source', 'status')
+        )
+        self.request_duration = Histogram(
+            'ai_composer_request_duration_seconds', 'Request latency.',
+            ('operation', 'file_type', 'source'), LATENCY_BUCKETS
+        )
+        self.stage_duration = Histogram(
+            'ai_composer_stage_duration_seconds', 'Time spent per stage of a request.',
+            ('operation', 'stage'), LATENCY_BUCKETS
+        )
+        self.attempts = Histogram(
+            'ai_composer_generation_attempts', 'Candidate batches generated per piece, retries included.',
+            ('genre',), ATTEMPT_BUCKETS
+        )
+        self.note_ratio = Histogram(
+            'ai_composer_note_ratio', 'note_on/note_off fraction of returned pieces.', ('genre',), NOTE_RATIO_BUCKETS
+        )
+        self.events = Counter(
+            'ai_composer_generated_events_total', 'Events of returned pieces.', ('genre',)
+        )
+
+    def observe(self, trace):
+        attributes = trace.attributes
+        source = attributes.get('source', '')
+        genre = attributes.get('genre', '')
+
+        with self._lock:
+            self.requests.inc((trace.operation, source, 'error' if trace.error else 'ok'))
+            self.request_duration.observe((trace.operation, attributes.get('file_type', ''), source), trace.duration)
+            for name, seconds in trace.stages.items():
+                self.stage_duration.observe((trace.operation, name), seconds)
+
+            if 'attempts' in attributes:
+                self.attempts.observe((genre,), attributes['attempts'])
+            if 'note_ratio' in attributes:
+                self.note_ratio.observe((genre,), attributes['note_ratio'])
+            if 'events' in attributes:
+                self.events.inc((genre,), attributes['events'])
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.requests, self.request_duration, self.stage_duration,
+                           self.attempts, self.note_ratio, self.events):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = TraceMetrics()
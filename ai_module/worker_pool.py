@@ -0,0 +1,154 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ai_module import tracing
+from ai_module.generator import DEFAULT_MODEL_PATH, generate, generate_piece
+from inference_backend import InferenceBackend
+
+logger = logging.getLogger(__name__)
+
+
+def _cpu_shares(workers):
+    """Split the CPUs this process may use into one contiguous share per worker."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+
+    if workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+
+    share = len(cpus) // workers
+    return [cpus[i * share:(i + 1) * share] for i in range(workers)]
+
+
+def _init_worker(model_path, cpu_shares, ready_workers, intra_op_threads, inter_op_threads, backend):
+    # spawned workers don't inherit the logging setup of the server
+    tracing.configure_logging()
+
+    cpus = cpu_shares.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    from ai_module.model_registry import registry
+    if backend is not None:
+        registry.backend = backend
+
+    if registry.backend == InferenceBackend.TENSORFLOW:
+        # thread pools have to be sized before tensorflow runs anything
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads or len(cpus))
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    elif registry.backend == InferenceBackend.ONNX:
+        from ai_module import onnx_engine
+        onnx_engine.intra_op_threads = intra_op_threads or len(cpus)
+
+    registry.warm_up([model_path])
+    with ready_workers.get_lock():
+        ready_workers.value += 1
+    logger.info("Generation worker %d ready on CPUs %s", os.getpid(), cpus)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _generate(kwargs):
+    return generate(**kwargs)
+
+
+def _traced(function, kwargs):
+    """Run function(**kwargs) and return its result with the stages it traced, for the caller's trace."""
+    with tracing.start_trace(function.__name__, record=False) as trace:
+        result = function(**kwargs)
+    return result, trace.to_dict()
+
+
+def _join_trace(future):
+    result, trace_info = future.result()
+    trace = tracing.current_trace()
+    if trace is not None:
+        trace.merge(trace_info)
+    return result
+
+
+class GenerationWorkerPool:
+    """Runs generate() in separate processes, each with its own warm model.
+
+    Python-side work of one generation doesn't hold up the others on the GIL, and every worker
+    gets its own share of the CPUs so TensorFlow thread pools don't oversubscribe cores.
+    intra_op_threads defaults to the size of the worker's CPU share. backend overrides the
+    inference backend of the workers' model registry.
+    """
+
+    def __init__(
+            self,
+            model_path=DEFAULT_MODEL_PATH,
+            workers=2,
+            intra_op_threads=None,
+            inter_op_threads=1,
+            backend=None
+    ):
+        self.model_path = model_path
+        self.workers = workers
+
+        context = multiprocessing.get_context('spawn')
+        cpu_shares = context.Queue()
+        for cpus in _cpu_shares(workers):
+            cpu_shares.put(cpus)
+        # workers whose initializer has finished, i.e. with a warm model
+        self._ready_workers = context.Value('i', 0)
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(model_path, cpu_shares, self._ready_workers, intra_op_threads, inter_op_threads, backend)
+        )
+
+    def warm_up(self, poll_interval=0.05):
+        """Start all workers and wait until each has loaded the model.
+
+        Every ping that finds no idle worker starts a new one, but a worker that is already up can
+        answer several pings, so the wait is on the workers counting themselves ready.
+        """
+        futures = [self._executor.submit(_ping) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+        while not self.ready():
+            time.sleep(poll_interval)
+
+    def ready_workers(self):
+        return self._ready_workers.value
+
+    def ready(self):
+        return self.ready_workers() >= self.workers
+
+    def submit(self, **kwargs):
+        """Run generate(**kwargs) in a worker; the Future resolves to MIDI bytes.
+
+        Callbacks such as progress can't cross the process boundary and are not supported.
+        """
+        kwargs['model_path'] = self.model_path
+        kwargs['as_bytes'] = True
+        return self._executor.submit(_generate, kwargs)
+
+    def generate(self, **kwargs):
+        """Run generate(**kwargs) in a worker and wait for the MIDI bytes.
+
+        The stages traced in the worker are added to the trace of the calling thread.
+        """
+        kwargs['model_path'] = self.model_path
+        kwargs['as_bytes'] = True
+        return _join_trace(self._executor.submit(_traced, generate, kwargs))
+
+    def generate_piece(self, **kwargs):
+        """Run generate_piece(**kwargs) in a worker and wait for its (events, genre_vector)."""
+        kwargs['model_path'] = self.model_path
+        return _join_trace(self._executor.submit(_traced, generate_piece, kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown()
@@ -1,23 +1,200 @@
 import io
+import logging
+import os
+import threading
+import time
 
-from flask import Flask, send_file, request
+import numpy as np
+from flask import Flask, Response, send_file, request, jsonify, stream_with_context
 from flask_cors import CORS
 
 import ai_module.generator
+import audio_renderer
+from ai_module.model_registry import model_file_hash, registry
+from ai_module.rejection_stats import rejection_stats
+from ai_module.scheduler import GenerationScheduler
+from ai_module.tracing import Trace, annotate, configure_logging, metrics, record_trace, stage, start_trace, use_trace
+from ai_module.worker_pool import GenerationWorkerPool
+from composition_pool import CompositionPool
 from diversity import Diversity
 from file_type import FileType
-from files_utils import midi_to_bytes, midi_to_mp3
+from files_utils import midi_messages_to_audio_stream, midi_to_mp3
+from inference_backend import InferenceBackend
+from job_status import JobStatus
+from jobs import JobManager, QueueFullError
+from result_cache import ResultCache, cache_key
+
+# AI_COMPOSER_LOG_LEVEL=DEBUG also logs per-attempt details and a JSON trace of every request,
+# WARNING keeps the generation path quiet
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 CORS(app, origins=["http://localhost:7666"], methods=["GET", "POST", "OPTIONS"], allow_headers=["Content-Type"])
 
+SOUNDFONT_PATH = os.environ.get('AI_COMPOSER_SOUNDFONT', 'FluidR3_GM.sf2')
+
+# resident synths for MP3/WAV conversion, each keeps its own copy of the soundfont in memory;
+# conversions beyond that many at once load a temporary synth
+SYNTH_POOL_SIZE = int(os.environ.get('AI_COMPOSER_SYNTH_POOL_SIZE', audio_renderer.DEFAULT_POOL_SIZE))
+
+# streams running at once, each with a synth of its own for the whole generation; more get a 503
+STREAM_SYNTHS = int(os.environ.get('AI_COMPOSER_STREAM_SYNTHS', 1))
+
+# generated MIDI files are also saved to ai_module/results/ in the background
+ARCHIVE_RESULTS = os.environ.get('AI_COMPOSER_ARCHIVE_RESULTS', '1') != '0'
+
+# tflite-dynamic / tflite-float16 run a reduced-precision copy of the model instead of tensorflow,
+# onnx runs an exported copy with ONNX Runtime and doesn't import tensorflow at all
+INFERENCE_BACKEND = InferenceBackend(os.environ.get('AI_COMPOSER_INFERENCE_BACKEND', InferenceBackend.TENSORFLOW))
+registry.backend = INFERENCE_BACKEND
+
+# generation worker processes started with `python app.py` import this module as __mp_main__;
+# only the server process builds the cache, generation pools and job manager and warms up
+SERVER_PROCESS = __name__ != '__mp_main__'
+
+# requests with an explicit seed are deterministic and their files are cached
+result_cache = ResultCache(
+    os.environ.get('AI_COMPOSER_CACHE_DIR', 'ai_module/cache'),
+    max_memory_bytes=int(os.environ.get('AI_COMPOSER_CACHE_MEMORY_MB', 64)) * 1024 * 1024,
+    max_disk_bytes=int(os.environ.get('AI_COMPOSER_CACHE_DISK_MB', 1024)) * 1024 * 1024
+) if SERVER_PROCESS else None
+
+# with workers > 0 generation runs in that many processes instead of in this one
+GENERATION_WORKERS = int(os.environ.get('AI_COMPOSER_GENERATION_WORKERS', 0))
+
+if not SERVER_PROCESS:
+    scheduler = worker_pool = None
+elif GENERATION_WORKERS > 0:
+    scheduler = None
+    worker_pool = GenerationWorkerPool(
+        ai_module.generator.DEFAULT_MODEL_PATH,
+        workers=GENERATION_WORKERS,
+        intra_op_threads=int(os.environ.get('AI_COMPOSER_INTRA_OP_THREADS', 0)) or None,
+        inter_op_threads=int(os.environ.get('AI_COMPOSER_INTER_OP_THREADS', 1)),
+        backend=INFERENCE_BACKEND
+    )
+else:
+    worker_pool = None
+    # concurrent requests are stepped through the model together
+    scheduler = GenerationScheduler(
+        ai_module.generator.DEFAULT_MODEL_PATH,
+        max_batch_size=int(os.environ.get('AI_COMPOSER_MAX_BATCH_SIZE', 32)),
+        max_wait=float(os.environ.get('AI_COMPOSER_MAX_BATCH_WAIT_MS', 5)) / 1000
+    )
+
+
+def compose_piece(genre, diversity, length):
+    if worker_pool is not None:
+        return worker_pool.generate_piece(genre=genre, diversity=diversity, sequence_length=length)
+    return ai_module.generator.generate_piece(genre=genre, diversity=diversity, sequence_length=length, scheduler=scheduler)
+
+
+# unseeded requests are served from pieces pre-generated while the server is idle
+composition_pool = CompositionPool(
+    compose_piece,
+    size_per_key=int(os.environ.get('AI_COMPOSER_POOL_SIZE', 2)),
+    max_keys=int(os.environ.get('AI_COMPOSER_POOL_MAX_KEYS', 32))
+) if SERVER_PROCESS else None
+
+
+# error of the last warm-up, shown by /ready until the model is loaded
+warm_up_error = None
+
+
+def warm_up():
+    """Load the model and soundfont so the first request doesn't pay for it.
+
+    Runs in the background: the server answers right away, /ready tells when this is done.
+    """
+    global warm_up_error
+    start = time.perf_counter()
+    warm_up_error = None
+    try:
+        if not os.path.exists(ai_module.generator.DEFAULT_MODEL_PATH):
+            raise FileNotFoundError(f"Model file not found: {ai_module.generator.DEFAULT_MODEL_PATH}")
+
+        if worker_pool is not None:
+            worker_pool.warm_up()
+        else:
+            registry.warm_up([ai_module.generator.DEFAULT_MODEL_PATH])
+
+        # keep the soundfont loaded in the process instead of reloading it for every conversion
+        if audio_renderer.is_available() and os.path.exists(SOUNDFONT_PATH):
+            audio_renderer.get_renderer(SOUNDFONT_PATH, SYNTH_POOL_SIZE)
+    except Exception as e:
+        warm_up_error = str(e)
+        logger.error("Warm-up failed: %s", e)
+        return
+
+    logger.info("Warm-up finished in %.1fs", time.perf_counter() - start)
+
+
+# generation workers load their own model; AI_COMPOSER_WARM_UP=0 skips warm-up, the model then
+# loads with the first request
+WARM_UP = os.environ.get('AI_COMPOSER_WARM_UP', '1') != '0'
+if SERVER_PROCESS and WARM_UP:
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+def model_ready():
+    """Whether generation would run on a loaded model, in this process or in every generation worker."""
+    if worker_pool is not None:
+        return worker_pool.ready()
+    return registry.is_warm(ai_module.generator.DEFAULT_MODEL_PATH)
+
 
 @app.route('/')
 def home():
     return 'Welcome to AI Composer!'
 
 
+@app.route('/health')
+def health():
+    return jsonify({'status': 'up'})
+
+
+@app.route('/ready')
+def ready():
+    # from the model's current state, so a model loaded by a request after a failed warm-up counts
+    if model_ready():
+        return jsonify({'status': 'ready'})
+    if warm_up_error is not None:
+        return jsonify({'status': 'failed', 'error': warm_up_error}), 503
+    return jsonify({'status': 'warming_up' if WARM_UP else 'not_loaded'}), 503
+
+
+@app.route('/models')
+def models():
+    return jsonify(registry.stats())
+
+
+@app.route('/cache')
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+
+@app.route('/pool')
+def pool_stats():
+    return jsonify(composition_pool.stats())
+
+
+@app.route('/rejections')
+def rejections():
+    return jsonify(rejection_stats.stats())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/scheduler')
+def scheduler_stats():
+    return jsonify(scheduler.stats() if scheduler is not None else {})
+
+
 instrument_codes = {
     'trumpet': 57,
     'piano': 1,
@@ -45,41 +222,294 @@ def percent_to_value(percent):
     return max(min_val, (percent / 100.0) * max_val)
 
 
+def parse_generation_request(data):
+    return {
+        'music_genre': data.get('music_genre').lower(),
+        'main_instrument': get_instrument_code(data.get('main_instrument').lower()),
+        'file_type': data.get('file_type').lower(),
+        'sequences': percent_to_value(data.get('sequence_length_percentage')),
+        'diversity': get_diversity_level(data.get('diversity_percentage')),
+        'seed': int(data['seed']) % 2 ** 32 if data.get('seed') is not None else None,
+    }
+
+
+def generate_midi_bytes(params, progress=None):
+    with composition_pool.busy():
+        return _generate_midi_bytes(params, progress)
+
+
+def _generate_midi_bytes(params, progress):
+    if worker_pool is not None:
+        return worker_pool.generate(
+            genre=params['music_genre'],
+            instrument=params['main_instrument'],
+            sequence_length=params['sequences'],
+            diversity=params['diversity'],
+            archive=ARCHIVE_RESULTS,
+            seed=params['seed']
+        )
+
+    return ai_module.generator.generate(
+        genre=params['music_genre'],
+        instrument=params['main_instrument'],
+        sequence_length=params['sequences'],
+        diversity=params['diversity'],
+        scheduler=scheduler,
+        as_bytes=True,
+        archive=ARCHIVE_RESULTS,
+        progress=progress,
+        seed=params['seed']
+    )
+
+
+def pooled_midi_bytes(params, progress=None):
+    """MIDI bytes of a pre-generated piece matching the request, or None if none is ready."""
+    with stage('pool'):
+        piece = composition_pool.take(params['music_genre'], params['diversity'], params['sequences'])
+    if piece is None:
+        return None
+
+    # pooled pieces are generated at the length bucket, which can be longer than the request
+    events, genre_vector = piece
+    events = events[:int(np.ceil(params['sequences']))]
+    annotate(source='pool', genre=ai_module.generator.genre_label(params['music_genre']), events=len(events))
+    if progress is not None:
+        progress(len(events), len(events))
+    return ai_module.generator.finish_piece(
+        events,
+        genre_vector,
+        instrument=params['main_instrument'],
+        as_bytes=True,
+        archive=ARCHIVE_RESULTS
+    )
+
+
+file_type_info = {
+    FileType.MP3: ('audio/mpeg', 'music.mp3'),
+    FileType.MIDI: ('audio/midi', 'music.mid'),
+    FileType.WAV: ('audio/mpeg', 'music.wav'),
+}
+
+
+def convert_midi(midi_bytes, file_type):
+    if file_type == FileType.MIDI:
+        return midi_bytes
+
+    with stage('convert'):
+        if file_type == FileType.MP3:
+            return midi_to_mp3(midi_bytes, SOUNDFONT_PATH, synth_pool_size=SYNTH_POOL_SIZE)
+        elif file_type == FileType.WAV:
+            return midi_to_mp3(midi_bytes, SOUNDFONT_PATH, return_wav=True, synth_pool_size=SYNTH_POOL_SIZE)
+    raise ValueError(f"Unsupported file type: {file_type}")
+
+
+def result_cache_key(params, file_type):
+    return cache_key(
+        music_genre=params['music_genre'],
+        main_instrument=params['main_instrument'],
+        sequences=params['sequences'],
+        diversity=params['diversity'],
+        seed=params['seed'],
+        file_type=file_type,
+        model=model_file_hash(ai_module.generator.DEFAULT_MODEL_PATH),
+        backend=INFERENCE_BACKEND
+    )
+
+
+def produce_file(params, progress=None, on_stage=None):
+    """Returns (file bytes, mimetype, download name).
+
+    on_stage is called with 'generating' and 'converting' when those stages start.
+
+    Unseeded requests take a pre-generated piece from the composition pool when one is ready.
+    Seeded requests are looked up in the result cache first; on a miss for an audio file the
+    cached MIDI of the same piece is reused if there is one.
+    """
+    file_type = params['file_type']
+    if file_type not in file_type_info:
+        raise ValueError(f"Unsupported file type: {file_type}")
+    mimetype, download_name = file_type_info[file_type]
+    on_stage = on_stage or (lambda stage: None)
+
+    if params['seed'] is None:
+        on_stage('generating')
+        midi_bytes = pooled_midi_bytes(params, progress)
+        if midi_bytes is None:
+            annotate(source='generated')
+            midi_bytes = generate_midi_bytes(params, progress)
+        on_stage('converting')
+        return convert_midi(midi_bytes, file_type), mimetype, download_name
+
+    file_key = result_cache_key(params, file_type)
+    with stage('cache'):
+        file_bytes = result_cache.get(file_key)
+    if file_bytes is not None:
+        annotate(source='cache')
+        return file_bytes, mimetype, download_name
+
+    midi_key = result_cache_key(params, FileType.MIDI)
+    with stage('cache'):
+        midi_bytes = result_cache.get(midi_key) if file_type != FileType.MIDI else None
+    annotate(source='cached_midi' if midi_bytes is not None else 'generated')
+    if midi_bytes is None:
+        on_stage('generating')
+        midi_bytes = generate_midi_bytes(params, progress)
+        result_cache.put(midi_key, midi_bytes)
+
+    on_stage('converting')
+    file_bytes = convert_midi(midi_bytes, file_type)
+    if file_type != FileType.MIDI:
+        result_cache.put(file_key, file_bytes)
+
+    return file_bytes, mimetype, download_name
+
+
 @app.route('/generate_music', methods=['POST'])
 def generate_music():
     data = request.get_json()
+    params = parse_generation_request(data)
+
+    logger.debug("Generation request: %s", params)
+
+    # seeded requests are served whole, deterministic and through the result cache
+    streamable = params['file_type'] in (FileType.MP3, FileType.WAV) and params['seed'] is None
+    # only a JSON true streams, a string such as "false" would otherwise count as true
+    if data.get('stream') is True and streamable and audio_renderer.is_available():
+        return stream_music(params)
+
+    with start_trace('generate_music', **trace_attributes(params)):
+        file_bytes, mimetype, download_name = produce_file(params)
 
-    music_genre = data.get('music_genre').lower()
-    main_instrument = get_instrument_code(data.get('main_instrument').lower())
-    file_type = data.get('file_type').lower()
-    sequences = percent_to_value(data.get('sequence_length_percentage'))
-    diversity = get_diversity_level(data.get('diversity_percentage'))
+    return send_file(io.BytesIO(file_bytes), mimetype=mimetype, as_attachment=True, download_name=download_name)
 
-    print(sequences)
 
-    midi_file = ai_module.generator.generate(
-        genre=music_genre,
-        instrument=main_instrument,
-        sequence_length=sequences,
-        diversity=diversity
+def trace_attributes(params):
+    # file_type is a metrics label, so any unsupported type is counted as one value
+    file_type = params['file_type']
+    return {
+        'file_type': file_type if file_type in file_type_info else 'invalid',
+        'length': params['sequences'],
+        'diversity': params['diversity'],
+        'seeded': params['seed'] is not None,
+    }
+
+
+def run_generation_job(job):
+    with start_trace('job', job_id=job.id, **trace_attributes(job.params)):
+        return produce_file(job.params, progress=job.update_progress, on_stage=job.set_stage)
+
+
+jobs = JobManager(
+    run_generation_job,
+    workers=int(os.environ.get('AI_COMPOSER_JOB_WORKERS', 2)),
+    max_pending=int(os.environ.get('AI_COMPOSER_JOB_QUEUE_SIZE', 16)),
+    max_finished=int(os.environ.get('AI_COMPOSER_JOB_MAX_FINISHED', 256)),
+    max_result_bytes=int(os.environ.get('AI_COMPOSER_JOB_RESULTS_MB', 256)) * 1024 * 1024
+) if SERVER_PROCESS else None
+
+
+@app.route('/jobs')
+def jobs_stats():
+    return jsonify(jobs.stats())
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    params = parse_generation_request(request.get_json())
+
+    try:
+        job = jobs.submit(params)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 429
+
+    return jsonify(job.to_dict()), 202, {'Location': f'/jobs/{job.id}'}
+
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+
+    job_info = job.to_dict()
+    if job.status == JobStatus.DONE:
+        job_info['result_url'] = f'/jobs/{job.id}/result'
+    return jsonify(job_info)
+
+
+@app.route('/jobs/<job_id>/result')
+def get_job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    if job.status == JobStatus.FAILED:
+        return jsonify({'error': job.error}), 500
+    if job.status != JobStatus.DONE:
+        return jsonify(job.to_dict()), 409
+
+    return send_file(io.BytesIO(job.result), mimetype=job.mimetype, as_attachment=True, download_name=job.download_name)
+
+
+def busy_while(messages):
+    with composition_pool.busy():
+        yield from messages
+
+
+def traced_stream(chunks, trace):
+    """Streams finish after the view returned, so their trace is recorded when the last chunk is sent.
+
+    The trace is current while every chunk is produced, so generation stages and attributes end up in it.
+    """
+    chunks = iter(chunks)
+    try:
+        while True:
+            with use_trace(trace):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    except Exception as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        trace.finish()
+        record_trace(trace)
+
+
+def stream_music(params):
+    file_type = params['file_type']
+    renderer = audio_renderer.get_renderer(SOUNDFONT_PATH, SYNTH_POOL_SIZE)
+    try:
+        synth = renderer.checkout_stream_synth(STREAM_SYNTHS)
+    except audio_renderer.SynthsBusyError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+
+    messages = busy_while(ai_module.generator.generate_stream(
+        genre=params['music_genre'],
+        instrument=params['main_instrument'],
+        sequence_length=params['sequences'],
+        diversity=params['diversity'],
+        archive=ARCHIVE_RESULTS
+    ))
+    chunks = midi_messages_to_audio_stream(
+        messages,
+        ai_module.generator.TICKS_PER_BEAT,
+        SOUNDFONT_PATH,
+        return_wav=file_type == FileType.WAV,
+        synth=synth,
+        synth_pool_size=SYNTH_POOL_SIZE
     )
 
-    midi_bytes = midi_to_bytes(midi_file)
-
-    if file_type == FileType.MP3:
-        mp3_bytes = midi_to_mp3(midi_bytes, 'FluidR3_GM.sf2')
-        mp3_buffer = io.BytesIO(mp3_bytes)
-        mp3_buffer.seek(0)
-        return send_file(mp3_buffer, mimetype='audio/mpeg', as_attachment=True, download_name='music.mp3')
-    elif file_type == FileType.MIDI:
-        midi_buffer = io.BytesIO(midi_bytes)
-        midi_buffer.seek(0)
-        return send_file(midi_buffer, mimetype='audio/midi', as_attachment=True, download_name='music.mid')
-    elif file_type == FileType.WAV:
-        mp3_bytes = midi_to_mp3(midi_bytes, 'FluidR3_GM.sf2', return_wav=True)
-        mp3_buffer = io.BytesIO(mp3_bytes)
-        mp3_buffer.seek(0)
-        return send_file(mp3_buffer, mimetype='audio/mpeg', as_attachment=True, download_name='music.wav')
+    mimetype = 'audio/wav' if file_type == FileType.WAV else 'audio/mpeg'
+    trace = Trace('stream', source='generated', **trace_attributes(params))
+    response = Response(
+        stream_with_context(traced_stream(chunks, trace)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=music.{file_type}'}
+    )
+    # called by the server once the response is done, also when the client left before the first chunk
+    response.call_on_close(lambda: renderer.release_stream_synth(synth))
+    return response
 
 
 if __name__ == '__main__':
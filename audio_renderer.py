@@ -0,0 +1,198 @@
+import functools
+import io
+import logging
+import os
+import queue
+import threading
+import time
+
+import mido
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2  # int16
+
+# let reverb and note releases ring out after the last event
+TAIL_SECONDS = 1.0
+
+
+@functools.cache
+def _fluidsynth():
+    """pyfluidsynth, imported on first use since loading the library slows down startup."""
+    try:
+        import fluidsynth
+    except (ImportError, OSError):
+        # pyfluidsynth is optional, files_utils falls back to the fluidsynth CLI without it
+        return None
+    return fluidsynth
+
+
+def is_available():
+    return _fluidsynth() is not None
+
+
+# synths kept loaded per soundfont, see AI_COMPOSER_SYNTH_POOL_SIZE in app.py
+DEFAULT_POOL_SIZE = 2
+
+
+class SynthsBusyError(Exception):
+    pass
+
+
+class AudioRenderer:
+    """Renders MIDI to PCM in-process with synths that keep the soundfont loaded.
+
+    pool_size synths are created up front and each render checks one out. When all of them are
+    busy a render gets a temporary synth of its own instead of waiting, which costs a soundfont
+    load like a fluidsynth CLI run.
+
+    Streams hold a synth for as long as the piece is being generated, so they get synths of
+    their own, created on first use and kept for the next stream.
+    """
+
+    def __init__(self, soundfont_path, pool_size=DEFAULT_POOL_SIZE, sample_rate=SAMPLE_RATE):
+        if not is_available():
+            raise RuntimeError("pyfluidsynth is not installed")
+        if not os.path.exists(soundfont_path):
+            raise FileNotFoundError(soundfont_path)
+
+        self.soundfont_path = soundfont_path
+        self.sample_rate = sample_rate
+        self.pool_size = pool_size
+
+        start = time.perf_counter()
+        self._synths = queue.Queue()
+        for _ in range(pool_size):
+            self._synths.put(self._create_synth())
+        self.load_time = time.perf_counter() - start
+
+        self._stream_lock = threading.Lock()
+        self._stream_synths = []
+        self._streams = 0
+
+    def _create_synth(self):
+        synth = _fluidsynth().Synth(samplerate=float(self.sample_rate))
+        synth.sfload(self.soundfont_path, update_midi_preset=1)
+        return synth
+
+    def iter_pcm(self, midi_bytes, chunk_frames=4096):
+        """Yield interleaved stereo int16 PCM chunks of at most chunk_frames frames."""
+        midi = mido.MidiFile(file=io.BytesIO(midi_bytes))
+        return self.iter_pcm_from_messages(mido.merge_tracks(midi.tracks), midi.ticks_per_beat, chunk_frames)
+
+    def iter_pcm_from_messages(self, messages, ticks_per_beat, chunk_frames=4096, synth=None):
+        """Like iter_pcm, but for messages with delta times in ticks as they are produced.
+
+        Audio up to each message is yielded as soon as the message arrives, so messages can come
+        from a generator that is still running. A synth from checkout_stream_synth() can be
+        passed in; it stays with the caller.
+        """
+        if synth is not None:
+            yield from self._render_messages(synth, messages, ticks_per_beat, chunk_frames)
+            return
+
+        try:
+            synth = self._synths.get_nowait()
+            pooled = True
+        except queue.Empty:
+            logger.debug("All %d synths busy, rendering with a temporary one", self.pool_size)
+            synth = self._create_synth()
+            pooled = False
+
+        try:
+            yield from self._render_messages(synth, messages, ticks_per_beat, chunk_frames)
+        finally:
+            if pooled:
+                self._synths.put(synth)
+            else:
+                synth.delete()
+
+    def checkout_stream_synth(self, max_streams):
+        """A synth for one stream, raises SynthsBusyError when max_streams are already running."""
+        with self._stream_lock:
+            if self._streams >= max_streams:
+                raise SynthsBusyError(f"all {max_streams} audio streams are busy")
+            self._streams += 1
+            synth = self._stream_synths.pop() if self._stream_synths else None
+
+        if synth is None:
+            try:
+                synth = self._create_synth()
+            except Exception:
+                with self._stream_lock:
+                    self._streams -= 1
+                raise
+        return synth
+
+    def release_stream_synth(self, synth):
+        with self._stream_lock:
+            self._streams -= 1
+            self._stream_synths.append(synth)
+
+    def _render_messages(self, synth, messages, ticks_per_beat, chunk_frames):
+        synth.system_reset()
+
+        tempo = 500000  # MIDI default, 120 bpm
+        pending = 0.0
+        for msg in messages:
+            if msg.time:
+                pending += mido.tick2second(msg.time, ticks_per_beat, tempo) * self.sample_rate
+                frames = int(pending)
+                if frames:
+                    pending -= frames
+                    yield from self._render_frames(synth, frames, chunk_frames)
+
+            if msg.type == 'set_tempo':
+                tempo = msg.tempo
+            elif not msg.is_meta:
+                self._send(synth, msg)
+
+        yield from self._render_frames(synth, int(TAIL_SECONDS * self.sample_rate), chunk_frames)
+
+    def render(self, midi_bytes):
+        """Render the whole piece, returns an (frames * CHANNELS,) int16 array."""
+        chunks = list(self.iter_pcm(midi_bytes, chunk_frames=self.sample_rate))
+        if not chunks:
+            return np.zeros(0, dtype=np.int16)
+        return np.concatenate(chunks)
+
+    @staticmethod
+    def _render_frames(synth, frames, chunk_frames):
+        while frames > 0:
+            n = min(frames, chunk_frames)
+            yield np.asarray(synth.get_samples(n), dtype=np.int16)
+            frames -= n
+
+    @staticmethod
+    def _send(synth, msg):
+        if msg.type == 'note_on':
+            synth.noteon(msg.channel, msg.note, msg.velocity)
+        elif msg.type == 'note_off':
+            synth.noteoff(msg.channel, msg.note)
+        elif msg.type == 'control_change':
+            synth.cc(msg.channel, msg.control, msg.value)
+        elif msg.type == 'program_change':
+            synth.program_change(msg.channel, msg.program)
+        elif msg.type == 'pitchwheel':
+            synth.pitch_bend(msg.channel, msg.pitch)
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+
+def get_renderer(soundfont_path, pool_size=DEFAULT_POOL_SIZE):
+    """Process-wide renderer per soundfont, created on first use; pool_size only counts then."""
+    path = os.path.abspath(soundfont_path)
+    renderer = _renderers.get(path)
+    if renderer is None:
+        with _renderers_lock:
+            renderer = _renderers.get(path)
+            if renderer is None:
+                renderer = AudioRenderer(path, pool_size=pool_size)
+                _renderers[path] = renderer
+                logger.info("Loaded soundfont %s in %.2fs", path, renderer.load_time)
+    return renderer
@@ -0,0 +1,78 @@
+"""Render time per second of audio: fluidsynth CLI vs in-process synth, cold and warm.
+
+Needs the soundfont, pyfluidsynth and (for the CLI baseline) the fluidsynth binary.
+Run from the repository root:
+
+    python -m benchmarks.audio_render --soundfont FluidR3_GM.sf2
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import mido
+import numpy as np
+
+import audio_renderer
+from ai_module.generator import build_midi, serialize_midi
+
+
+def sample_midi_bytes(length):
+    """A piano piece of alternating note_on/note_off events, 50-300 ticks apart."""
+    messages = []
+    for _ in range(length // 2):
+        note = int(np.random.randint(40, 90))
+        messages.append(mido.Message('note_on', note=note, velocity=int(np.random.randint(60, 110)),
+                                     time=int(np.random.randint(50, 300))))
+        messages.append(mido.Message('note_off', note=note, velocity=0, time=int(np.random.randint(50, 300))))
+    return serialize_midi(build_midi(messages, instrument=1))
+
+
+def time_cli(midi_bytes, soundfont_path):
+    from midi2audio import FluidSynth
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        midi_path = os.path.join(tmp_dir, 'in.mid')
+        wav_path = os.path.join(tmp_dir, 'out.wav')
+        with open(midi_path, 'wb') as midi_file:
+            midi_file.write(midi_bytes)
+
+        start = time.perf_counter()
+        FluidSynth(soundfont_path).midi_to_audio(midi_path, wav_path)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--soundfont', default='FluidR3_GM.sf2')
+    parser.add_argument('--length', type=int, default=500)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--skip-cli', action='store_true')
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    midi_bytes = sample_midi_bytes(args.length)
+
+    start = time.perf_counter()
+    renderer = audio_renderer.AudioRenderer(args.soundfont)
+    pcm = renderer.render(midi_bytes)
+    cold = time.perf_counter() - start
+
+    audio_seconds = len(pcm) / audio_renderer.CHANNELS / renderer.sample_rate
+    print(f"piece: {audio_seconds:.1f} s of audio")
+    print(f"in-process cold (soundfont load {renderer.load_time:.2f}s): {cold / audio_seconds * 1000:.1f} ms per audio second")
+
+    warm = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        renderer.render(midi_bytes)
+        warm.append(time.perf_counter() - start)
+    print(f"in-process warm: {np.mean(warm) / audio_seconds * 1000:.1f} ms per audio second")
+
+    if not args.skip_cli:
+        cli = [time_cli(midi_bytes, args.soundfont) for _ in range(args.repeats)]
+        print(f"fluidsynth CLI: {np.mean(cli) / audio_seconds * 1000:.1f} ms per audio second")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Startup time and resident memory of a generation process with each inference backend.
+
+Every backend is measured in a fresh interpreter: importing the generator, loading and warming
+up the engine, then generating one short piece. Also reports whether TensorFlow got imported.
+Run from the repository root (the onnx backend needs an exported .onnx file):
+
+    python -m benchmarks.backend_startup --backends tensorflow onnx
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from inference_backend import InferenceBackend
+
+MEASURE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+from ai_module.generator import generate_sequences_batch, generate_genre_vector, generate_random_seed_sequence
+from ai_module.model_registry import get_engine
+from ai_module.sampling import make_rng
+imported = time.perf_counter()
+engine = get_engine(sys.argv[1], backend=sys.argv[2])
+loaded = time.perf_counter()
+rng = make_rng(0)
+seeds = [generate_random_seed_sequence(length=20, rng=rng) for _ in range(4)]
+generate_sequences_batch(engine, seeds, generate_genre_vector('pop'), length=int(sys.argv[3]), decode=False, rng=rng)
+generated = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - start,
+    'load_seconds': loaded - imported,
+    'generate_seconds': generated - loaded,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'tensorflow_imported': 'tensorflow' in sys.modules,
+}))
+'''
+
+
+def measure(model_path, backend, length):
+    result = subprocess.run(
+        [sys.executable, '-c', MEASURE, model_path, backend, str(length)],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    from ai_module.generator import DEFAULT_MODEL_PATH
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--backends', nargs='+', default=[InferenceBackend.TENSORFLOW, InferenceBackend.ONNX])
+    parser.add_argument('--length', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'backend':<16} {'import s':>9} {'load s':>8} {'generate s':>11} {'peak RSS MB':>12} {'tensorflow':>11}")
+    for backend in args.backends:
+        result = measure(args.model, backend, args.length)
+        print(f"{backend:<16} {result['import_seconds']:9.2f} {result['load_seconds']:8.2f} "
+              f"{result['generate_seconds']:11.2f} {result['peak_rss_mb']:12.0f} {str(result['tensorflow_imported']):>11}")
+
+
+if __name__ == '__main__':
+    main()
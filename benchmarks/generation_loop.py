@@ -0,0 +1,66 @@
+"""Overhead of the generate_sequence loop itself, measured with a numpy stub instead of the model.
+
+Does not need TensorFlow. Run from the repository root:
+
+    python -m benchmarks.generation_loop --length 1000
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from ai_module.generator import generate_genre_vector, generate_random_seed_sequence, generate_sequences_batch
+from ai_module.inference import Engine
+from ai_module.sampling import make_rng
+
+
+class StubEngine(Engine):
+    """Returns fixed predictions of the right shape, so only the loop around the model is timed."""
+
+    def __init__(self, fixed_length=50, input_dim=11, genre_dim=3):
+        self.fixed_length = fixed_length
+        self.input_dim = input_dim
+        self.genre_dim = genre_dim
+        self._type_probs = np.array([[0.4, 0.3, 0.2, 0.1]], dtype=np.float32)
+        self._params = np.full((1, input_dim - 4), 0.5, dtype=np.float32)
+
+    def predict(self, sequence, genre):
+        batch_size = len(sequence)
+        return np.repeat(self._type_probs, batch_size, axis=0), np.repeat(self._params, batch_size, axis=0)
+
+
+def run(engine, batch_size, length, rng):
+    seeds = [generate_random_seed_sequence(length=20, rng=rng) for _ in range(batch_size)]
+    genre = generate_genre_vector('pop')
+
+    start = time.perf_counter()
+    generate_sequences_batch(engine, seeds, genre, length=length, temperatures=1.0, param_noise_stds=0.01, rng=rng)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    generate_sequences_batch(engine, seeds, genre, length=length, temperatures=1.0, param_noise_stds=0.01, rng=rng)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--length', type=int, default=1000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = make_rng(args.seed)
+    engine = StubEngine()
+
+    for batch_size in args.batch_sizes:
+        elapsed, peak = run(engine, batch_size, args.length, rng)
+        print(f"batch {batch_size:>3}: {elapsed * 1e6 / args.length:8.1f} us/step | "
+              f"{elapsed * 1e6 / (args.length * batch_size):8.1f} us/event | peak traced memory {peak / 1024:.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Import time profile of the server, from python -X importtime.
+
+Imports the modules in a fresh interpreter with warm-up turned off and lists the slowest
+imports by cumulative time. Fails if a heavy dependency that should only load lazily or during
+warm-up is imported, or if the total is above --budget-ms. Run from the repository root:
+
+    python -m benchmarks.import_time --top 15 --budget-ms 2000
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# loaded by warm-up or on first use, never by importing the server
+LAZY_MODULES = ['tensorflow', 'keras', 'onnxruntime', 'tflite_runtime', 'fluidsynth', 'midi2audio']
+
+
+def profile(module):
+    """Returns [(self us, cumulative us, depth, module name)] in import order."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env={**os.environ, 'AI_COMPOSER_WARM_UP': '0'}
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=['app'])
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        imports = profile(module)
+        total_ms = next(cumulative for _, cumulative, depth, name in imports if depth == 0 and name == module) / 1000
+
+        print(f"{module}: {total_ms:.0f} ms, {len(imports)} modules")
+        for self_us, cumulative_us, _, name in sorted(imports, key=lambda item: -item[1])[:args.top]:
+            print(f"  {cumulative_us / 1000:8.1f} ms cumulative {self_us / 1000:8.1f} ms self  {name}")
+
+        heavy = sorted({name for *_, name in imports if name.split('.')[0] in LAZY_MODULES})
+        if heavy:
+            failed = True
+            print(f"  imported at startup but should load lazily: {', '.join(heavy)}")
+        if args.budget_ms is not None and total_ms > args.budget_ms:
+            failed = True
+            print(f"  over budget: {total_ms:.0f} ms > {args.budget_ms:.0f} ms")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
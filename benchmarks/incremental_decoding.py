@@ -0,0 +1,99 @@
+"""Parity and speed of stateful incremental decoding against the windowed loop.
+
+Run from the repository root:
+
+    python -m benchmarks.incremental_decoding --length 300
+
+Parity is checked teacher-forced: both decoders see the same event stream, so predictions
+can be compared step by step. The first step must match (same window, same weights); the script
+fails if it differs by more than --tolerance. Later steps differ by design because the stateful
+decoder remembers more than fixed_length events, so incremental mode generates different pieces;
+the script reports how far apart they are and how often the most likely event type agrees.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from ai_module.generator import (
+    DEFAULT_MODEL_PATH,
+    create_random_event_vector,
+    generate_genre_vector,
+    generate_random_seed_sequence,
+    generate_sequence,
+)
+from ai_module.model_registry import get_engine
+from ai_module.sampling import make_rng
+
+
+def teacher_forced_parity(engine, genre, fixed_length, steps):
+    rng = make_rng()
+    events = np.array([create_random_event_vector(rng) for _ in range(fixed_length + steps)], dtype=np.float32)
+    genre = np.expand_dims(genre, axis=0)
+
+    with engine.stateful_decoder(1) as decoder:
+        stateful_type, stateful_params = decoder.prime(events[None, :fixed_length], genre)
+
+        type_diffs = []
+        params_diffs = []
+        type_agreement = []
+        for step in range(steps):
+            windowed_type, windowed_params = engine.predict(events[None, step:step + fixed_length], genre)
+            type_diffs.append(np.abs(windowed_type - stateful_type).max())
+            params_diffs.append(np.abs(windowed_params - stateful_params).max())
+            type_agreement.append(np.argmax(windowed_type) == np.argmax(stateful_type))
+
+            stateful_type, stateful_params = decoder.step(events[None, step + fixed_length:step + fixed_length + 1], genre)
+
+    return np.array(type_diffs), np.array(params_diffs), np.array(type_agreement)
+
+
+def timed_generation(engine, seed, genre, length, incremental, rng_seed):
+    rng = make_rng(rng_seed)
+    start = time.perf_counter()
+    messages = generate_sequence(engine, seed, genre, length=length, temperature=1.0, incremental=incremental, rng=rng)
+    return messages, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--length', type=int, default=300)
+    parser.add_argument('--parity-steps', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    engine = get_engine(args.model)
+    genre = generate_genre_vector('pop')
+
+    type_diffs, params_diffs, agreement = teacher_forced_parity(engine, genre, engine.fixed_length, args.parity_steps)
+    print(f"first step max diff: types {type_diffs[0]:.2e}, params {params_diffs[0]:.2e}")
+    print(f"later steps max diff: types {type_diffs[1:].max():.2e}, params {params_diffs[1:].max():.2e}")
+    print(f"event type argmax agreement: {agreement.mean():.1%}")
+
+    seed = generate_random_seed_sequence(length=20, rng=make_rng(args.seed))
+
+    # warm both paths so tracing is not measured
+    generate_sequence(engine, seed, genre, length=2)
+    generate_sequence(engine, seed, genre, length=2, incremental=True)
+
+    windowed, windowed_time = timed_generation(engine, seed, genre, args.length, False, args.seed)
+    incremental, incremental_time = timed_generation(engine, seed, genre, args.length, True, args.seed)
+
+    same_types = np.mean([a.type == b.type for a, b in zip(windowed, incremental)])
+    print(f"same RNG seed, event types equal: {same_types:.1%} (first event equal: {windowed[0] == incremental[0]})")
+    print(f"windowed: {windowed_time * 1000 / args.length:.3f} ms/event | "
+          f"incremental: {incremental_time * 1000 / args.length:.3f} ms/event | "
+          f"speedup {windowed_time / incremental_time:.1f}x")
+
+    first_step_diff = max(type_diffs[0], params_diffs[0])
+    if first_step_diff > args.tolerance:
+        print(f"FAILED: first step differs by {first_step_diff:.2e}, above tolerance {args.tolerance:.0e}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Per-step latency of model.predict vs the compiled inference step.
+
+Run from the repository root:
+
+    python -m benchmarks.inference_step --steps 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ai_module.generator import DEFAULT_MODEL_PATH, generate_genre_vector, generate_random_seed_sequence
+from ai_module.inference import InferenceEngine
+from ai_module.model_registry import get_model
+
+
+def time_steps(engine, sequence, genre, steps):
+    # first call pays for tracing, keep it out of the measurement
+    engine.predict(sequence, genre)
+
+    timings = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        engine.predict(sequence, genre)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--steps', type=int, default=200)
+    args = parser.parse_args()
+
+    model = get_model(args.model)
+    sequence = np.expand_dims(generate_random_seed_sequence(length=20), axis=0)
+    genre = np.expand_dims(generate_genre_vector('pop'), axis=0)
+
+    for name, compiled in (('model.predict', False), ('compiled step', True)):
+        timings = time_steps(InferenceEngine(model, compiled=compiled), sequence, genre, args.steps)
+        print(f"{name:>14}: mean {timings.mean():.3f} ms | p50 {np.percentile(timings, 50):.3f} ms | "
+              f"p95 {np.percentile(timings, 95):.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
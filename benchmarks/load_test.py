@@ -0,0 +1,90 @@
+"""Generation throughput with process-pool workers, for a growing number of workers.
+
+Run from the repository root:
+
+    python -m benchmarks.load_test --workers 1 2 4 --requests 16 --length 200
+
+With --url the same load is sent to a running server instead, e.g. one started with
+AI_COMPOSER_GENERATION_WORKERS=4:
+
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --requests 16
+"""
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from ai_module.generator import DEFAULT_MODEL_PATH
+from ai_module.worker_pool import GenerationWorkerPool
+from diversity import Diversity
+
+
+def run_pool(workers, requests, length, model_path):
+    pool = GenerationWorkerPool(model_path, workers=workers)
+    try:
+        pool.warm_up()
+
+        start = time.perf_counter()
+        futures = [
+            pool.submit(genre='pop', sequence_length=length, diversity=Diversity.MEDIUM, archive=False)
+            for _ in range(requests)
+        ]
+        wait(futures)
+        elapsed = time.perf_counter() - start
+
+        for future in futures:
+            future.result()
+        return elapsed
+    finally:
+        pool.shutdown()
+
+
+def post_generate(url, length_percentage):
+    body = json.dumps({
+        'music_genre': 'pop',
+        'main_instrument': 'piano',
+        'file_type': 'midi',
+        'sequence_length_percentage': length_percentage,
+        'diversity_percentage': 50,
+    }).encode()
+    request = urllib.request.Request(f'{url}/generate_music', data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def run_http(url, requests, concurrency, length):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        futures = [executor.submit(post_generate, url, length / 10) for _ in range(requests)]
+        for future in futures:
+            future.result()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--requests', type=int, default=16)
+    parser.add_argument('--length', type=int, default=200)
+    parser.add_argument('--url')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.url:
+        elapsed = run_http(args.url, args.requests, args.concurrency, args.length)
+        print(f"{args.requests} requests in {elapsed:.1f}s -> {args.requests / elapsed:.2f} req/s")
+        return
+
+    baseline = None
+    for workers in args.workers:
+        elapsed = run_pool(workers, args.requests, args.length, args.model)
+        throughput = args.requests / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>2} workers: {args.requests} requests in {elapsed:.1f}s -> "
+              f"{throughput:.2f} req/s ({throughput / baseline:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
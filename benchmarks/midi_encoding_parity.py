@@ -0,0 +1,81 @@
+"""Parity of the EventSequence MIDI encoder with mido.
+
+Encodes random event vectors with EventSequence.to_midi_bytes() and compares the bytes with
+what mido writes for to_midi() of the same sequence, running status included. Also checks that
+to_messages() -> from_messages() and reading the encoded file back with mido give the same
+events. Fails on the first mismatch. Needs only numpy and mido. Run from the repository root:
+
+    python -m benchmarks.midi_encoding_parity
+"""
+import argparse
+import io
+import sys
+
+import mido
+import numpy as np
+
+from ai_module.event_sequence import EVENT_FIELDS, EVENT_TYPES, TICKS_PER_BEAT, EventSequence
+from ai_module.sampling import make_rng
+
+
+def random_vectors(rng, length):
+    """Event vectors as the model outputs them; some fields are exactly 0 or 1 to hit the clipping edges."""
+    vectors = rng.random((length, len(EVENT_TYPES) + len(EVENT_FIELDS)), dtype=np.float32)
+    edges = rng.random(vectors.shape) < 0.05
+    vectors[edges] = rng.integers(0, 2, size=int(edges.sum()))
+    # mostly short delta times, as in generated pieces, so running status and 1-2 byte delta times are common
+    short = rng.random(length) < 0.8
+    vectors[short, -1] *= 0.002
+    return vectors
+
+
+def mido_bytes(sequence, instrument, ticks_per_beat):
+    buffer = io.BytesIO()
+    sequence.to_midi(instrument, ticks_per_beat).save(file=buffer)
+    return buffer.getvalue()
+
+
+def check(sequence, instrument, ticks_per_beat):
+    """None if the encoders agree, otherwise what differs."""
+    encoded = sequence.to_midi_bytes(instrument, ticks_per_beat)
+    expected = mido_bytes(sequence, instrument, ticks_per_beat)
+    if encoded != expected:
+        mismatches = (i for i, (a, b) in enumerate(zip(encoded, expected)) if a != b)
+        offset = next(mismatches, min(len(encoded), len(expected)))
+        return f"bytes differ from mido at offset {offset} ({len(encoded)} vs {len(expected)} bytes)"
+
+    if not np.array_equal(EventSequence.from_messages(sequence.to_messages()).events, sequence.events):
+        return "from_messages(to_messages()) changed the events"
+
+    read_back = EventSequence.from_midi(mido.MidiFile(file=io.BytesIO(encoded)))
+    written = sequence.with_instrument(instrument) if instrument is not None else sequence
+    if not np.array_equal(read_back.events, written.events):
+        return "events read back by mido differ"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sequences', type=int, default=200)
+    parser.add_argument('--max-length', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = make_rng(0)
+    for i in range(args.sequences):
+        # empty and single event sequences first, then random lengths
+        length = i if i < 2 else int(rng.integers(2, args.max_length + 1))
+        instrument = None if i % 4 == 0 else int(rng.integers(0, 128))
+        ticks_per_beat = TICKS_PER_BEAT if i % 3 else int(rng.integers(24, 961))
+
+        sequence = EventSequence.from_vectors(random_vectors(rng, length))
+        problem = check(sequence, instrument, ticks_per_beat)
+        if problem is not None:
+            print(f"FAILED: sequence {i} ({length} events, instrument {instrument}, "
+                  f"{ticks_per_beat} ticks per beat): {problem}")
+            sys.exit(1)
+
+    print(f"OK: {args.sequences} sequences encode byte for byte as mido does")
+
+
+if __name__ == '__main__':
+    main()
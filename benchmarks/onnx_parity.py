@@ -0,0 +1,66 @@
+"""Parity of the ONNX Runtime backend with the TensorFlow model.
+
+Feeds the same random windows to both, batched and one at a time, and fails if the outputs
+differ by more than --tolerance. Needs TensorFlow and an exported .onnx file. Run from the
+repository root:
+
+    python -m benchmarks.onnx_parity
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from ai_module.generator import DEFAULT_MODEL_PATH, create_random_event_vector, generate_genre_vector
+from ai_module.model_registry import get_engine
+from ai_module.sampling import make_rng
+from inference_backend import InferenceBackend
+
+
+def random_batch(engine, rng, batch_size):
+    sequences = np.stack([
+        np.array([create_random_event_vector(rng) for _ in range(engine.fixed_length)], dtype=np.float32)
+        for _ in range(batch_size)
+    ])
+    genres = np.stack([generate_genre_vector(str(rng.choice(['pop', 'rock', 'country', 'undefined'])))
+                       for _ in range(batch_size)])
+    return sequences, genres
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--batches', type=int, default=16)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 32])
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    reference = get_engine(args.model, backend=InferenceBackend.TENSORFLOW)
+    engine = get_engine(args.model, backend=InferenceBackend.ONNX)
+
+    rng = make_rng(0)
+    worst = 0.0
+    for batch_size in args.batch_sizes:
+        type_diff = params_diff = 0.0
+        agreement = []
+        for _ in range(args.batches):
+            sequences, genres = random_batch(engine, rng, batch_size)
+            y_type, y_params = engine.predict(sequences, genres)
+            ref_type, ref_params = reference.predict(sequences, genres)
+
+            type_diff = max(type_diff, float(np.abs(y_type - ref_type).max()))
+            params_diff = max(params_diff, float(np.abs(y_params - ref_params).max()))
+            agreement.extend(np.argmax(y_type, axis=1) == np.argmax(ref_type, axis=1))
+
+        worst = max(worst, type_diff, params_diff)
+        print(f"batch {batch_size:>3}: max diff types {type_diff:.2e}, params {params_diff:.2e}, "
+              f"argmax agreement {np.mean(agreement):.1%}")
+
+    if worst > args.tolerance:
+        print(f"FAILED: max difference {worst:.2e} above tolerance {args.tolerance:.0e}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Where the time of a generation request goes, for sequence lengths from 100 to 1000 events.
+
+Times model load, per-step inference inside the generation loop, the loop around it, decoding,
+building and serializing the MIDI (midi_to_bytes, save_midi, and the EventSequence encoder the
+server uses) and conversion to WAV and MP3,
+and writes the results as JSON so runs on different commits can be compared.
+
+Runs offline: --model random (default) builds a randomly initialised model with the inputs and
+outputs of final_model_3.keras, --model stub uses a numpy stub and doesn't need TensorFlow.
+Audio conversion is skipped without the soundfont or ffmpeg. Run from the repository root:
+
+    python -m benchmarks.suite --lengths 100 250 500 1000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from ai_module.event_sequence import EVENT_FIELDS, EVENT_TYPES, EventSequence
+from ai_module.generator import (
+    build_midi,
+    decode_event_vectors,
+    generate_genre_vector,
+    generate_random_seed_sequence,
+    generate_sequences_batch,
+    save_midi,
+)
+from ai_module.inference import GENRE_INPUT, SEQUENCE_INPUT, Engine
+from ai_module.model_registry import registry
+from ai_module.sampling import make_rng
+from benchmarks.generation_loop import StubEngine
+from files_utils import midi_to_bytes, midi_to_mp3
+from inference_backend import InferenceBackend
+
+
+class TimedEngine(Engine):
+    """Wraps an engine and adds up the time spent in predict()."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.fixed_length = engine.fixed_length
+        self.input_dim = engine.input_dim
+        self.genre_dim = engine.genre_dim
+        self.seconds = 0.0
+        self.calls = 0
+
+    def predict(self, sequence, genre):
+        start = time.perf_counter()
+        outputs = self.engine.predict(sequence, genre)
+        self.seconds += time.perf_counter() - start
+        self.calls += 1
+        return outputs
+
+
+def build_random_model(fixed_length=50, input_dim=11, genre_dim=3):
+    """Untrained model with the inputs and outputs of final_model_3.keras.
+
+    The hidden layers are an assumption, so inference times are indicative only.
+    """
+    from tensorflow import keras
+
+    sequence = keras.Input((fixed_length, input_dim), name=SEQUENCE_INPUT)
+    genre = keras.Input((genre_dim,), name=GENRE_INPUT)
+    x = keras.layers.LSTM(256, return_sequences=True)(sequence)
+    x = keras.layers.LSTM(256)(x)
+    x = keras.layers.Concatenate()([x, genre])
+    x = keras.layers.Dense(128, activation='relu')(x)
+    event_type = keras.layers.Dense(len(EVENT_TYPES), activation='softmax', name='event_type')(x)
+    params = keras.layers.Dense(len(EVENT_FIELDS), activation='sigmoid', name='params')(x)
+    return keras.Model({SEQUENCE_INPUT: sequence, GENRE_INPUT: genre}, [event_type, params])
+
+
+def load_engine(model, backend, tmp_dir):
+    """Returns (engine, model load seconds); load time includes warm-up, as at server startup."""
+    if model == 'stub':
+        return StubEngine(), None
+
+    if model == 'random':
+        model = os.path.join(tmp_dir, 'random_model.keras')
+        build_random_model().save(model)
+
+    start = time.perf_counter()
+    engine = registry.get_engine(model, backend=backend)
+    return engine, time.perf_counter() - start
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_length(engine, length, repeats, candidates, soundfont_path, tmp_dir):
+    samples = {}
+
+    def record(stage, seconds):
+        samples.setdefault(stage, []).append(seconds * 1000)
+
+    for repeat in range(repeats):
+        rng = make_rng(repeat)
+        seeds = [generate_random_seed_sequence(length=int(rng.integers(1, 40)), rng=rng) for _ in range(candidates)]
+        timed_engine = TimedEngine(engine)
+
+        events, loop_seconds = timed(
+            generate_sequences_batch, timed_engine, seeds, generate_genre_vector('pop'),
+            length=length, temperatures=1.0, param_noise_stds=0.01, decode=False, rng=rng
+        )
+        record('generation_loop', loop_seconds)
+        record('inference', timed_engine.seconds)
+        record('inference_per_step', timed_engine.seconds / timed_engine.calls)
+        record('loop_overhead', loop_seconds - timed_engine.seconds)
+
+        messages, seconds = timed(decode_event_vectors, events[0])
+        record('decode', seconds)
+
+        midi, seconds = timed(build_midi, messages, 1)
+        record('build_midi', seconds)
+
+        midi_bytes, seconds = timed(midi_to_bytes, midi)
+        record('midi_to_bytes', seconds)
+
+        _, seconds = timed(save_midi, messages, os.path.join(tmp_dir, 'bench.mid'), 1)
+        record('save_midi', seconds)
+
+        sequence, seconds = timed(EventSequence.from_vectors, events[0])
+        record('event_sequence', seconds)
+
+        _, seconds = timed(sequence.to_midi_bytes, 1)
+        record('event_sequence_to_midi_bytes', seconds)
+
+        if soundfont_path is not None:
+            _, seconds = timed(midi_to_mp3, midi_bytes, soundfont_path, return_wav=True)
+            record('convert_wav', seconds)
+            _, seconds = timed(midi_to_mp3, midi_bytes, soundfont_path)
+            record('convert_mp3', seconds)
+
+    return [
+        {
+            'length': length,
+            'stage': stage,
+            'mean_ms': float(np.mean(values)),
+            'p50_ms': float(np.median(values)),
+            'min_ms': float(np.min(values)),
+            'repeats': len(values),
+        }
+        for stage, values in samples.items()
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='random', help="'random', 'stub' or the path of a .keras model")
+    parser.add_argument('--backend', default=InferenceBackend.TENSORFLOW)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[100, 250, 500, 1000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--candidates', type=int, default=4)
+    parser.add_argument('--soundfont', default='FluidR3_GM.sf2')
+    parser.add_argument('--output', help="JSON file to write, printed to stdout by default")
+    args = parser.parse_args()
+
+    audio_skipped = None
+    soundfont_path = args.soundfont
+    if not os.path.exists(args.soundfont):
+        audio_skipped = f"soundfont not found: {args.soundfont}"
+    elif shutil.which('ffmpeg') is None:
+        audio_skipped = "ffmpeg not found"
+    if audio_skipped:
+        soundfont_path = None
+        print(f"[INFO] Skipping audio conversion, {audio_skipped}", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine, load_seconds = load_engine(args.model, InferenceBackend(args.backend), tmp_dir)
+
+        results = []
+        for length in args.lengths:
+            print(f"[INFO] Benchmarking length {length}", file=sys.stderr)
+            results.extend(run_length(engine, length, args.repeats, args.candidates, soundfont_path, tmp_dir))
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'model': args.model,
+        'backend': args.backend,
+        'candidates': args.candidates,
+        'model_load_seconds': load_seconds,
+        'audio_skipped': audio_skipped,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Quality, speed and memory of the reduced-precision TFLite backends against the float32 model.
+
+Every backend generates the same fixed seeds with the same sampling RNG streams. Because the
+sampled sequences diverge as soon as one event type differs, they are compared in aggregate:
+event type distribution (total variation distance to float32) and note ratio per candidate.
+A teacher-forced pass over identical random windows also compares the raw outputs.
+
+Needs TensorFlow for the float32 model and for converting. Run from the repository root:
+
+    python -m benchmarks.tflite_quality --seeds 8 --length 300
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+
+from ai_module.generator import (
+    DEFAULT_MODEL_PATH,
+    EVENT_TYPES,
+    create_random_event_vector,
+    event_note_ratios,
+    generate_genre_vector,
+    generate_random_seed_sequence,
+    generate_sequences_batch,
+)
+from ai_module.model_registry import get_engine
+from ai_module.sampling import make_rng
+from inference_backend import InferenceBackend
+
+GENRES = ['pop', 'rock', 'country']
+
+
+def teacher_forced(engine, reference, windows=64, batch_size=4):
+    rng = make_rng(0)
+    type_diffs, params_diffs, agreement = [], [], []
+    for i in range(windows // batch_size):
+        sequences = np.stack([
+            np.array([create_random_event_vector(rng) for _ in range(engine.fixed_length)], dtype=np.float32)
+            for _ in range(batch_size)
+        ])
+        genres = np.stack([generate_genre_vector(GENRES[i % len(GENRES)])] * batch_size)
+
+        y_type, y_params = engine.predict(sequences, genres)
+        ref_type, ref_params = reference.predict(sequences, genres)
+        type_diffs.append(np.abs(y_type - ref_type).max())
+        params_diffs.append(np.abs(y_params - ref_params).max())
+        agreement.extend(np.argmax(y_type, axis=1) == np.argmax(ref_type, axis=1))
+
+    return max(type_diffs), max(params_diffs), float(np.mean(agreement))
+
+
+def generate_fixed_seeds(engine, seeds, length, candidates=4):
+    events = []
+    start = time.perf_counter()
+    for seed in range(seeds):
+        rng = make_rng(seed)
+        seed_sequences = [
+            generate_random_seed_sequence(length=int(rng.integers(1, 40)), rng=rng) for _ in range(candidates)
+        ]
+        genre = generate_genre_vector(GENRES[seed % len(GENRES)])
+        events.append(generate_sequences_batch(
+            engine, seed_sequences, genre, length=length, temperatures=1.0, param_noise_stds=0.01,
+            decode=False, rng=rng
+        ))
+    step_time = (time.perf_counter() - start) / (seeds * length)
+
+    events = np.concatenate(events)
+    type_counts = np.bincount(np.argmax(events[..., :len(EVENT_TYPES)], axis=-1).ravel(), minlength=len(EVENT_TYPES))
+    return type_counts / type_counts.sum(), event_note_ratios(events), step_time
+
+
+def peak_rss(model_path, backend, length):
+    """Peak resident memory in MB of a fresh process that loads the backend and generates."""
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(_measure_rss, (model_path, backend, length))
+
+
+def _measure_rss(model_path, backend, length):
+    generate_fixed_seeds(get_engine(model_path, backend=backend), 1, length)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--backends', nargs='+', default=[InferenceBackend.TFLITE_DYNAMIC, InferenceBackend.TFLITE_FLOAT16])
+    parser.add_argument('--seeds', type=int, default=8)
+    parser.add_argument('--length', type=int, default=300)
+    parser.add_argument('--skip-memory', action='store_true')
+    args = parser.parse_args()
+
+    reference = get_engine(args.model, backend=InferenceBackend.TENSORFLOW)
+    ref_types, ref_ratios, ref_step = generate_fixed_seeds(reference, args.seeds, args.length)
+
+    print(f"{'backend':<16} {'step ms':>8} {'TV dist':>8} {'note ratio':>11} {'|d ratio|':>10} "
+          f"{'max dp':>8} {'max dparams':>11} {'argmax':>7} {'RSS MB':>7}")
+
+    for backend in [InferenceBackend.TENSORFLOW, *map(InferenceBackend, args.backends)]:
+        engine = get_engine(args.model, backend=backend)
+        if backend == InferenceBackend.TENSORFLOW:
+            types, ratios, step_time = ref_types, ref_ratios, ref_step
+        else:
+            types, ratios, step_time = generate_fixed_seeds(engine, args.seeds, args.length)
+
+        type_diff, params_diff, agreement = teacher_forced(engine, reference)
+        distance = 0.5 * np.abs(types - ref_types).sum()
+        rss = float('nan') if args.skip_memory else peak_rss(args.model, backend, args.length)
+
+        print(f"{backend:<16} {step_time * 1000:8.3f} {distance:8.4f} {ratios.mean():11.3f} "
+              f"{np.abs(ratios - ref_ratios).mean():10.3f} {type_diff:8.2e} {params_diff:11.2e} "
+              f"{agreement:7.1%} {rss:7.0f}")
+
+    print("event types: " + ", ".join(EVENT_TYPES))
+    print(f"tensorflow distribution: {np.round(ref_types, 3).tolist()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from ai_module.generator import genre_label
+
+logger = logging.getLogger(__name__)
+
+
+class CompositionPool:
+    """Keeps finished pieces ready per (genre, diversity, length bucket) for unseeded requests.
+
+    compose(genre, diversity, length) generates one piece. The pool only stores what it returns,
+    so pieces can be kept independent of the instrument and finished when they are served.
+
+    Keys start being kept filled when they are first asked for; at most max_keys of them are
+    kept, the least recently asked for ones are dropped. The refill thread only generates while
+    no foreground generation is running (see busy()), so it uses idle time instead of competing
+    with requests. Requested lengths are rounded up to the next length_bucket, so a piece can be
+    longer than asked for and has to be trimmed by the caller. Lengths above max_length are not
+    pooled.
+    """
+
+    def __init__(self, compose, size_per_key=2, max_keys=32, length_bucket=100, max_length=1000):
+        self._compose = compose
+        self.size_per_key = size_per_key
+        self.max_keys = max_keys
+        self.length_bucket = length_bucket
+        self.max_length = max_length
+
+        self._pieces = OrderedDict()
+        self._busy = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_errors = 0
+        self.refill_time = 0.0
+
+    def key(self, genre, diversity, length):
+        # genres without their own generation values are generated the same way as 'undefined'
+        genre = genre_label(genre)
+        bucket = math.ceil(length / self.length_bucket) * self.length_bucket
+        return genre, diversity, int(bucket)
+
+    def take(self, genre, diversity, length):
+        """Return a ready piece of at least length events, or None if there is none yet."""
+        if length > self.max_length:
+            return None
+
+        key = self.key(genre, diversity, length)
+        with self._condition:
+            pieces = self._pieces.get(key)
+            if pieces is None:
+                pieces = self._pieces[key] = deque()
+                while len(self._pieces) > self.max_keys:
+                    self._pieces.popitem(last=False)
+            else:
+                self._pieces.move_to_end(key)
+
+            piece = pieces.popleft() if pieces else None
+            if piece is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._condition.notify_all()
+
+        self._ensure_started()
+        return piece
+
+    @contextmanager
+    def busy(self):
+        """Mark a foreground generation, the pool doesn't start refills while one is running."""
+        with self._condition:
+            self._busy += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._busy -= 1
+                self._condition.notify_all()
+
+    def _ensure_started(self):
+        if self._thread is None and self.size_per_key > 0:
+            with self._condition:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='composition-pool', daemon=True)
+                    self._thread.start()
+
+    def _next_key(self):
+        """The most recently asked for key among the emptiest ones, or None if all are full."""
+        wanted = [
+            (len(pieces), -position, key)
+            for position, (key, pieces) in enumerate(self._pieces.items())
+            if len(pieces) < self.size_per_key
+        ]
+        return min(wanted)[2] if wanted else None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                key = None
+                while self._busy or key is None:
+                    key = None if self._busy else self._next_key()
+                    if key is None:
+                        self._condition.wait()
+
+            start = time.perf_counter()
+            try:
+                piece = self._compose(*key)
+            except Exception as e:
+                logger.error("Pre-generation for %s failed: %s", key, e)
+                with self._condition:
+                    self.refill_errors += 1
+                time.sleep(1)
+                continue
+
+            with self._condition:
+                self.refill_time += time.perf_counter() - start
+                pieces = self._pieces.get(key)
+                if pieces is not None and len(pieces) < self.size_per_key:
+                    pieces.append(piece)
+                    self.refills += 1
+
+    def stats(self):
+        with self._condition:
+            requests = self.hits + self.misses
+            return {
+                'size_per_key': self.size_per_key,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else None,
+                'refills': self.refills,
+                'refill_errors': self.refill_errors,
+                'refill_time': self.refill_time,
+                'keys': {
+                    f'{genre}/{diversity}/{length}': len(pieces)
+                    for (genre, diversity, length), pieces in self._pieces.items()
+                },
+            }
@@ -1,9 +1,17 @@
+import contextvars
 import io
 import os
+import struct
+import subprocess
+import tempfile
+import threading
+import wave
 
-from midi2audio import FluidSynth
 from mido import MidiFile
-from pydub import AudioSegment
+
+import audio_renderer
+
+FFMPEG = 'ffmpeg'
 
 
 def midi_to_bytes(midi: MidiFile) -> bytes:
@@ -14,34 +22,163 @@ def midi_to_bytes(midi: MidiFile) -> bytes:
     return midi_buffer.getvalue()
 
 
-def midi_to_mp3(midi_bytes: bytes, soundfont_path: str, return_wav=False) -> bytes:
-    """Convert MIDI bytes to MP3 bytes using FluidSynth and pydub."""
+def pcm_to_wav(pcm, sample_rate=audio_renderer.SAMPLE_RATE, channels=audio_renderer.CHANNELS) -> bytes:
+    """Wrap interleaved int16 PCM samples in a WAV container."""
+    wav_io = io.BytesIO()
+    with wave.open(wav_io, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(audio_renderer.SAMPLE_WIDTH)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm.tobytes())
+    return wav_io.getvalue()
 
-    # Save MIDI to temporary file
-    with open('temp.mid', 'wb') as midi_file:
-        midi_file.write(midi_bytes)
 
-    # Convert MIDI to WAV using FluidSynth
-    fs = FluidSynth(soundfont_path)
-    fs.midi_to_audio('temp.mid', 'temp.wav')
+def encode_mp3(data: bytes, input_args) -> bytes:
+    """Encode audio to MP3 by piping it through ffmpeg, without touching the disk."""
+    process = subprocess.run(
+        [FFMPEG, '-hide_banner', '-loglevel', 'error', *input_args, '-i', 'pipe:0', '-f', 'mp3', 'pipe:1'],
+        input=data,
+        capture_output=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {process.stderr.decode(errors='replace').strip()}")
+    return process.stdout
 
-    if return_wav:
-        with open('temp.wav', 'rb') as wav_file:
+
+def pcm_to_mp3(pcm, sample_rate=audio_renderer.SAMPLE_RATE, channels=audio_renderer.CHANNELS) -> bytes:
+    """Encode interleaved int16 PCM samples as MP3."""
+    return encode_mp3(pcm.tobytes(), ['-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels)])
+
+
+def wav_to_mp3(wav_bytes: bytes) -> bytes:
+    """Encode WAV bytes as MP3."""
+    return encode_mp3(wav_bytes, ['-f', 'wav'])
+
+
+def midi_to_mp3(midi_bytes: bytes, soundfont_path: str, return_wav=False,
+                synth_pool_size=audio_renderer.DEFAULT_POOL_SIZE) -> bytes:
+    """Convert MIDI bytes to MP3 (or WAV) bytes.
+
+    Renders in-process with a resident pyfluidsynth synth when it is installed, otherwise
+    shells out to the FluidSynth CLI. Either way the result is encoded through pipes, and
+    safe to call from concurrent requests. synth_pool_size is the number of resident synths,
+    used when the renderer is created.
+    """
+    if audio_renderer.is_available():
+        renderer = audio_renderer.get_renderer(soundfont_path, synth_pool_size)
+        pcm = renderer.render(midi_bytes)
+        if return_wav:
+            return pcm_to_wav(pcm, renderer.sample_rate)
+        return pcm_to_mp3(pcm, renderer.sample_rate)
+
+    # the CLI needs real files, give every call its own directory that is removed even on errors
+    with tempfile.TemporaryDirectory(prefix='ai_composer_') as tmp_dir:
+        midi_path = os.path.join(tmp_dir, 'input.mid')
+        wav_path = os.path.join(tmp_dir, 'output.wav')
+
+        with open(midi_path, 'wb') as midi_file:
+            midi_file.write(midi_bytes)
+
+        # only needed without pyfluidsynth, so it is imported on first use
+        from midi2audio import FluidSynth
+        FluidSynth(soundfont_path).midi_to_audio(midi_path, wav_path)
+
+        with open(wav_path, 'rb') as wav_file:
             wav_bytes = wav_file.read()
-        os.remove('temp.mid')
+
+    if return_wav:
         return wav_bytes
 
-    # Convert WAV to MP3 using pydub
-    audio = AudioSegment.from_wav('temp.wav')
-    mp3_io = io.BytesIO()
-    audio.export(mp3_io, format='mp3')
-    mp3_io.seek(0)
+    return wav_to_mp3(wav_bytes)
+
+
+def wav_stream_header(sample_rate=audio_renderer.SAMPLE_RATE, channels=audio_renderer.CHANNELS) -> bytes:
+    """WAV header for a stream of unknown length; sizes are set to the maximum, which players accept."""
+    byte_rate = sample_rate * channels * audio_renderer.SAMPLE_WIDTH
+    block_align = channels * audio_renderer.SAMPLE_WIDTH
+    return (
+        b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate, block_align,
+                                8 * audio_renderer.SAMPLE_WIDTH)
+        + b'data' + struct.pack('<I', 0xFFFFFFFF)
+    )
+
+
+def iter_wav(pcm_chunks, sample_rate=audio_renderer.SAMPLE_RATE, channels=audio_renderer.CHANNELS):
+    """Yield a WAV header and then the PCM chunks as they are rendered."""
+    yield wav_stream_header(sample_rate, channels)
+    for chunk in pcm_chunks:
+        yield chunk.tobytes()
+
+
+def iter_mp3(pcm_chunks, sample_rate=audio_renderer.SAMPLE_RATE, channels=audio_renderer.CHANNELS,
+             read_size=16384):
+    """Yield MP3 frames while PCM chunks are still being rendered.
 
-    # Remove temporary files
-    os.remove('temp.mid')
-    os.remove('temp.wav')
+    PCM is fed to ffmpeg's stdin from a separate thread, encoded frames are read from its
+    stdout here. Closing the generator early (client went away) kills ffmpeg and stops rendering.
+    """
+    process = subprocess.Popen(
+        [FFMPEG, '-hide_banner', '-loglevel', 'error',
+         '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels), '-i', 'pipe:0',
+         '-f', 'mp3', '-flush_packets', '1', 'pipe:1'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    errors = []
 
-    return mp3_io.getvalue()
+    def feed():
+        try:
+            for chunk in pcm_chunks:
+                process.stdin.write(chunk.tobytes())
+        except Exception as e:
+            errors.append(e)
+        finally:
+            close = getattr(pcm_chunks, 'close', None)
+            if close is not None:
+                close()
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    # rendering pulls the messages, so the feeder runs in this context to keep the request's trace
+    context = contextvars.copy_context()
+    feeder = threading.Thread(target=context.run, args=(feed,), name='mp3-feeder', daemon=True)
+    feeder.start()
+
+    try:
+        while True:
+            data = process.stdout.read1(read_size)
+            if not data:
+                break
+            yield data
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        feeder.join()
+
+    if errors:
+        raise errors[0]
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {process.stderr.read().decode(errors='replace').strip()}")
+
+
+def midi_messages_to_audio_stream(messages, ticks_per_beat, soundfont_path: str, return_wav=False, synth=None,
+                                  synth_pool_size=audio_renderer.DEFAULT_POOL_SIZE):
+    """Render and encode messages as they arrive, yielding MP3 (or WAV) bytes.
+
+    synth is one checked out with AudioRenderer.checkout_stream_synth(), so a long stream doesn't
+    hold a synth of the conversion pool. Needs pyfluidsynth, the CLI can only convert whole files.
+    """
+    renderer = audio_renderer.get_renderer(soundfont_path, synth_pool_size)
+    pcm_chunks = renderer.iter_pcm_from_messages(messages, ticks_per_beat, synth=synth)
+    if return_wav:
+        return iter_wav(pcm_chunks, renderer.sample_rate)
+    return iter_mp3(pcm_chunks, renderer.sample_rate)
 
 
 def load_midi_from_disk():
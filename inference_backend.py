@@ -0,0 +1,8 @@
+from enum import StrEnum
+
+
+class InferenceBackend(StrEnum):
+    TENSORFLOW = 'tensorflow'
+    TFLITE_DYNAMIC = 'tflite-dynamic'
+    TFLITE_FLOAT16 = 'tflite-float16'
+    ONNX = 'onnx'
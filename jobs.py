@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from job_status import JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    params: dict
+    status: str = JobStatus.QUEUED
+    stage: str = 'queued'
+    events_generated: int = 0
+    events_total: int = 0
+    created_at: float = field(default_factory=time.time)
+    started_at: float = None
+    finished_at: float = None
+    error: str = None
+    result: bytes = None
+    mimetype: str = None
+    download_name: str = None
+
+    def set_stage(self, stage):
+        self.stage = stage
+
+    def update_progress(self, events_generated, events_total):
+        self.events_generated = events_generated
+        self.events_total = events_total
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'events_generated': self.events_generated,
+            'events_total': self.events_total,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """Runs jobs on a thread pool and keeps them in memory until they expire.
+
+    At most max_pending jobs can be queued or running; submit() raises QueueFullError beyond
+    that. Finished jobs are dropped result_ttl seconds after they finish, or earlier, oldest
+    first, when more than max_finished of them or more than max_result_bytes of results are kept.
+    A job whose result alone is larger than max_result_bytes fails instead.
+    """
+
+    def __init__(self, run_job, workers=2, max_pending=16, result_ttl=3600, max_finished=256,
+                 max_result_bytes=256 * 1024 * 1024):
+        self._run_job = run_job
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job-worker')
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self.max_result_bytes = max_result_bytes
+
+        self._jobs = {}
+        # finished job ids in the order they finished, with the size of their result
+        self._finished = OrderedDict()
+        self._result_bytes = 0
+        self._lock = threading.Lock()
+
+    def submit(self, params):
+        with self._lock:
+            self._expire()
+            pending = sum(1 for job in self._jobs.values() if job.status in (JobStatus.QUEUED, JobStatus.RUNNING))
+            if pending >= self.max_pending:
+                raise QueueFullError(f"{pending} jobs are already waiting")
+
+            job = Job(id=uuid.uuid4().hex, params=params)
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        try:
+            result, mimetype, download_name = self._run_job(job)
+            if len(result) > self.max_result_bytes:
+                raise ValueError(f"result too large: {len(result)} bytes, at most {self.max_result_bytes} are kept")
+            job.result, job.mimetype, job.download_name = result, mimetype, download_name
+            job.stage = 'done'
+            job.status = JobStatus.DONE
+        except Exception as e:
+            logger.error("Job %s failed: %s", job.id, e)
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                size = len(job.result) if job.result is not None else 0
+                self._finished[job.id] = size
+                self._result_bytes += size
+                # the job that just finished is kept, so its client never sees it disappear
+                while len(self._finished) > 1 and (
+                        len(self._finished) > self.max_finished or self._result_bytes > self.max_result_bytes):
+                    self._drop_oldest_finished()
+
+    def _drop_oldest_finished(self):
+        job_id, size = self._finished.popitem(last=False)
+        self._result_bytes -= size
+        del self._jobs[job_id]
+
+    def _expire(self):
+        now = time.time()
+        while self._finished:
+            job = self._jobs[next(iter(self._finished))]
+            if now - job.finished_at <= self.result_ttl:
+                break
+            self._drop_oldest_finished()
+
+    def stats(self):
+        with self._lock:
+            counts = {status.value: 0 for status in JobStatus}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {'max_pending': self.max_pending, 'result_bytes': self._result_bytes, **counts}